@@ -0,0 +1,109 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+Measure the memory a CidrFindr holds on to per subnet with each storage backend, using tracemalloc:
+
+    python -m benchmarks.memory --scales 100000,1000000
+    python -m benchmarks.memory --max-ratio 0.1
+"""
+
+from .topologies import TOPOLOGIES
+from cidr_findr import ArrayNetwork, CidrFindr, Network
+from cidr_findr.cidr_findr import format_ip, parse_cidr, parse_ip
+import argparse
+import gc
+import sys
+import tracemalloc
+
+NETWORK_CLASSES = {
+    "Network": Network,
+    "ArrayNetwork": ArrayNetwork,
+}
+
+DEFAULT_SCALES = (10000, 100000)
+
+def clear_caches():
+    for cached in (parse_cidr, parse_ip, format_ip):
+        cached.cache_clear()
+
+def measure(network_class, networks, subnets):
+    """
+    Return the bytes retained by, and the peak while building, a CidrFindr.
+    The parse caches are shared and bounded, so they are emptied and not counted.
+    """
+
+    clear_caches()
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+
+        findr = CidrFindr(networks=networks, subnets=subnets, network_class=network_class)
+        findr.next_subnet(28)
+
+        clear_caches()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del findr
+
+    return {"retained": current - before, "peak": peak - before}
+
+def run(topology, scales, log=None):
+    """
+    Measure every network class at every scale, returning {"topology/scale/class": measurement}
+    """
+
+    results = {}
+
+    for scale in scales:
+        networks, subnets = TOPOLOGIES[topology](scale)
+
+        for name, network_class in NETWORK_CLASSES.items():
+            key = "{}/{}/{}".format(topology, scale, name)
+            result = measure(network_class, networks, subnets)
+            results[key] = result
+
+            if log:
+                log("{:<40} {:>8.1f} B/subnet retained {:>12} B peak".format(key, result["retained"] / max(len(subnets), 1), result["peak"]))
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure CidrFindr memory use per subnet")
+    parser.add_argument("--topology", default="packed", choices=sorted(TOPOLOGIES))
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="comma-separated subnet counts")
+    parser.add_argument("--max-ratio", type=float, default=0.0, help="fail if ArrayNetwork retains, or peaks at, more than this share of what Network does")
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    results = run(args.topology, scales, log=print)
+
+    if args.max_ratio:
+        failed = False
+
+        for scale in scales:
+            compact = results["{}/{}/ArrayNetwork".format(args.topology, scale)]
+            plain = results["{}/{}/Network".format(args.topology, scale)]
+
+            for measurement, verb in (("retained", "retains"), ("peak", "peaks at")):
+                if compact[measurement] > plain[measurement] * args.max_ratio:
+                    print("REGRESSION {}/{}: ArrayNetwork {} {:.2f}x of Network".format(args.topology, scale, verb, compact[measurement] / plain[measurement]))
+                    failed = True
+
+        if failed:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+Time CidrFindr on synthetic topologies, optionally comparing against a stored baseline:
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --baseline baseline.json --tolerance 1.5
+"""
+
+from .topologies import TOPOLOGIES
+from cidr_findr import CidrFindr, CidrFindrException
+import argparse
+import json
+import platform
+import sys
+import time
+
+DEFAULT_SCALES = (10, 100, 1000, 10000)
+
+# A mix of sizes like a stack asking for public, private and data subnets
+BATCH = (24, 24, 25, 25, 26, 26, 27, 28)
+
+def best_of(func, repeat):
+    """
+    The fastest of several runs of func, in seconds
+    """
+
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+def attempt(func, *args):
+    try:
+        func(*args)
+    except CidrFindrException:
+        pass
+
+def measure(topology, count, repeat=5, seed=0):
+    """
+    Return the timings of construction, a single request and a batch on one topology
+    """
+
+    networks, subnets = TOPOLOGIES[topology](count, seed)
+
+    def build():
+        return CidrFindr(networks=networks, subnets=subnets)
+
+    # Each request gets a fresh allocator so that every run sees the same state
+    findrs = [build() for _ in range(repeat * 2)]
+
+    return {
+        "init": best_of(build, repeat),
+        "next_subnet": best_of(lambda: attempt(findrs.pop().next_subnet, 24), repeat),
+        "next_subnets": best_of(lambda: attempt(findrs.pop().next_subnets, BATCH), repeat),
+    }
+
+def run(topologies, scales, repeat=5, seed=0, log=None):
+    results = {}
+
+    for topology in topologies:
+        for count in scales:
+            for operation, seconds in measure(topology, count, repeat, seed).items():
+                key = "{}/{}/{}".format(topology, count, operation)
+                results[key] = seconds
+
+                if log:
+                    log("{:<40} {:>12.6f}s".format(key, seconds))
+
+    return results
+
+def compare(results, baseline, tolerance, noise=0.0001):
+    """
+    Return (key, baseline, current, ratio) for every result slower than tolerance
+    times its baseline, ignoring slowdowns of less than noise seconds
+    """
+
+    regressions = []
+
+    for key, before in sorted(baseline.items()):
+        if key not in results or before <= 0:
+            continue
+
+        ratio = results[key] / before
+
+        if ratio > tolerance and results[key] - before > noise:
+            regressions.append((key, before, results[key], ratio))
+
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark CidrFindr on synthetic VPC topologies")
+    parser.add_argument("--topologies", default=",".join(TOPOLOGIES), help="comma-separated topology names")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="comma-separated subnet counts")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results stored in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="slowdown ratio counted as a regression")
+    parser.add_argument("--noise", type=float, default=0.0001, help="slowdowns of fewer seconds than this are ignored")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.topologies.split(","),
+        [int(scale) for scale in args.scales.split(",")],
+        repeat=args.repeat,
+        seed=args.seed,
+        log=print,
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "seed": args.seed,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, args.tolerance, args.noise)
+
+        for key, before, after, ratio in regressions:
+            print("REGRESSION {}: {:.6f}s -> {:.6f}s ({:.2f}x)".format(key, before, after, ratio))
+
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr.cidr_findr import Range
+import random
+
+def _network_for(addresses, minimum=16):
+    """
+    The smallest network around 10.0.0.0 holding at least the given number of addresses
+    """
+
+    size = min(minimum, 32 - max(addresses - 1, 1).bit_length())
+
+    return Range(base=Range.ip_to_num("10.0.0.0") & -2 ** (32 - size), size=size)
+
+def _blocks(network, size):
+    return range(network.base, network.top, 2 ** (32 - size))
+
+def _cidr(base, size):
+    return Range(base=base, size=size).to_cidr()
+
+def empty(count, seed=0):
+    """
+    An empty /16: count is ignored
+    """
+
+    return ["10.0.0.0/16"], []
+
+def packed(count, seed=0):
+    """
+    count /28s scattered over a network nine tenths full
+    """
+
+    rng = random.Random(seed)
+    network = _network_for(count * 16 * 10 // 9)
+    bases = rng.sample(_blocks(network, 28), count)
+
+    return [network.to_cidr()], [_cidr(base, 28) for base in bases]
+
+def fragmented(count, seed=0):
+    """
+    count subnets of mixed sizes from /24 to /28, with gaps of every size between them
+    """
+
+    rng = random.Random(seed)
+    network = _network_for(count * 512)
+    subnets = []
+    base = network.base
+
+    for _ in range(count):
+        size = rng.randint(24, 28)
+        block = 2 ** (32 - size)
+
+        # Leave a gap of a random number of /28s before the next subnet
+        base += rng.randrange(0, 16) * 16
+        base = -(-base // block) * block
+
+        if base + block > network.top:
+            break
+
+        subnets.append(_cidr(base, size))
+        base += block
+
+    rng.shuffle(subnets)
+
+    return [network.to_cidr()], subnets
+
+def secondary(count, seed=0):
+    """
+    count /28s filling /20 networks one after another, with one more empty /20 at the end
+    """
+
+    rng = random.Random(seed)
+    first = Range.ip_to_num("10.0.0.0")
+    networks = [Range(base=first + i * 2 ** 12, size=20) for i in range(-(-count // 256) + 1)]
+    bases = range(first, first + count * 16, 16)
+
+    subnets = [_cidr(base, 28) for base in bases]
+    rng.shuffle(subnets)
+
+    return [network.to_cidr() for network in networks], subnets
+
+def space_at_end(count, seed=0):
+    """
+    A network filled by count /28s and then /24s, with only its last /24 free
+    """
+
+    count = -(-count // 16) * 16
+    network = _network_for(count * 16 + 256 * 2)
+
+    blocks = _blocks(network, 28)
+    subnets = [_cidr(base, 28) for base in blocks[:count]]
+
+    subnets.extend(_cidr(base, 24) for base in range(blocks[count], network.top - 256, 256))
+
+    random.Random(seed).shuffle(subnets)
+
+    return [network.to_cidr()], subnets
+
+TOPOLOGIES = {
+    "empty": empty,
+    "packed": packed,
+    "fragmented": fragmented,
+    "secondary": secondary,
+    "space_at_end": space_at_end,
+}
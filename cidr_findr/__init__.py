@@ -8,5 +8,8 @@ http://aws.amazon.com/apache2.0/
 or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
 """
 
-from .cidr_findr import CidrFindr, CidrFindrException
+from .cidr_findr import CidrFindr, CidrFindrException, Network
+from .buddy import BuddyNetwork
+from .compact import ArrayNetwork
 from .lambda_handler import handler as lambda_handler
+from .lambda_handler import batch_handler as lambda_batch_handler
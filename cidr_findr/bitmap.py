@@ -0,0 +1,72 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from bisect import bisect_left, bisect_right
+from .cidr_findr import Network
+import numpy
+
+# The smallest block the handler hands out (see lambda_utils.sizes_valid)
+UNIT_SIZE = 28
+UNIT_SHIFT = 32 - UNIT_SIZE
+
+class BitmapNetwork(Network):
+    """
+    A Network that also keeps one byte per /28 of address space, so that a
+    request is answered by a vectorised search rather than a Python loop.
+    Suited to large networks packed with small subnets.
+    """
+
+    def __init__(self, network, subnets):
+        self._units = numpy.zeros(1 << (UNIT_SIZE - network.size), dtype=numpy.bool_)
+
+        super().__init__(network, subnets)
+
+    def _rebuild(self):
+        self._units[:] = False
+
+        for base, top in zip(self._bases, self._tops):
+            self._mark(base, top, True)
+
+    def _mark(self, base, top, value):
+        first = (max(base, self.network.base) - self.network.base) >> UNIT_SHIFT
+        last = (min(top, self.network.top) - self.network.base + (1 << UNIT_SHIFT) - 1) >> UNIT_SHIFT
+
+        if first < last:
+            self._units[first:last] = value
+
+    def _find(self, req):
+        if req > UNIT_SIZE:
+            return super()._find(req)
+
+        # One row per aligned /req candidate; a row with any used unit is taken
+        taken = self._units.reshape(-1, 1 << (UNIT_SIZE - req)).any(axis=1)
+        index = int(taken.argmin())
+
+        if taken[index]:
+            return None
+
+        return self.network.base + (index << (32 - req))
+
+    def _use(self, base, top):
+        super()._use(base, top)
+
+        self._mark(base, top, True)
+
+    def _unuse(self, base, top):
+        super()._unuse(base, top)
+
+        self._mark(base, top, False)
+
+        # Units shared with a neighbouring interval are still partly in use
+        start = bisect_right(self._tops, base - (1 << UNIT_SHIFT))
+        end = bisect_left(self._bases, top + (1 << UNIT_SHIFT))
+
+        for i in range(start, end):
+            self._mark(self._bases[i], self._tops[i], True)
@@ -0,0 +1,132 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from heapq import heappop, heappush
+from .cidr_findr import Network, aligned_blocks
+
+class BuddyNetwork(Network):
+    """
+    A Network that keeps its free space as maximal aligned CIDR blocks,
+    with one free list per prefix length, like a buddy allocator.
+
+    A /N request takes the lowest free block of size N or larger and splits
+    off the remainder; releasing a block merges it back with its buddy.
+    The answers are the same first-fit answers as a plain Network.
+    """
+
+    def _rebuild(self):
+        # prefix length -> set of free bases, plus a heap of the same bases
+        # that may hold stale entries which are dropped lazily
+        self._free = {}
+        self._heaps = {}
+
+        for start, end in self.free_gaps():
+            for base, size in aligned_blocks(start, end, self.network.bits):
+                self._push(base, size)
+
+    def _push(self, base, size):
+        free = self._free.setdefault(size, set())
+        heap = self._heaps.setdefault(size, [])
+
+        free.add(base)
+        heappush(heap, base)
+
+        if len(heap) > 2 * len(free) + 16:
+            self._heaps[size] = sorted(free)
+
+    def _find(self, req):
+        best = None
+
+        for size, heap in self._heaps.items():
+            if size > req:
+                continue
+
+            free = self._free[size]
+
+            while heap and heap[0] not in free:
+                heappop(heap)
+
+            if heap and (best is None or heap[0] < best):
+                best = heap[0]
+
+        return best
+
+    def _use(self, base, top):
+        super()._use(base, top)
+
+        base = max(base, self.network.base)
+        top = min(top, self.network.top)
+
+        for piece, size in aligned_blocks(base, top, self.network.bits):
+            if not self._carve(piece, size):
+                self._rebuild()
+                return
+
+    def _carve(self, base, size):
+        """
+        Remove a /size block from the free block that holds it, returning the
+        rest of that block to the free lists. False if no free block holds it.
+        """
+
+        for parent in range(size, self.network.size - 1, -1):
+            block = 1 << (self.network.bits - parent)
+            candidate = base - (base - self.network.base) % block
+            free = self._free.get(parent)
+
+            if free and candidate in free:
+                free.discard(candidate)
+
+                while parent < size:
+                    parent += 1
+                    half = 1 << (self.network.bits - parent)
+
+                    if base >= candidate + half:
+                        self._push(candidate, parent)
+                        candidate += half
+                    else:
+                        self._push(candidate + half, parent)
+
+                return True
+
+        return False
+
+    def _unuse(self, base, top):
+        super()._unuse(base, top)
+
+        base = max(base, self.network.base)
+        top = min(top, self.network.top)
+
+        for piece, size in aligned_blocks(base, top, self.network.bits):
+            self._merge(piece, size)
+
+    def _merge(self, base, size):
+        """
+        Free a /size block, joining it with its buddy for as long as the buddy is free too
+        """
+
+        while size > self.network.size:
+            block = 1 << (self.network.bits - size)
+
+            if (base - self.network.base) % (2 * block):
+                buddy = base - block
+            else:
+                buddy = base + block
+
+            free = self._free.get(size)
+
+            if not free or buddy not in free:
+                break
+
+            free.discard(buddy)
+
+            base = min(base, buddy)
+            size -= 1
+
+        self._push(base, size)
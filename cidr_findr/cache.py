@@ -0,0 +1,104 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from collections import OrderedDict
+import time
+import zlib
+
+class Fingerprint(object):
+    """
+    A cheap, order-independent summary of a stream of CIDR strings:
+    how many there were plus the sum of their CRCs
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.digest = 0
+
+    def track(self, cidrs):
+        """
+        Pass the CIDRs through unchanged while adding them to the fingerprint
+        """
+
+        for cidr in cidrs:
+            self.count += 1
+            self.digest = (self.digest + zlib.crc32(cidr.encode("utf-8"))) & 0xFFFFFFFFFFFFFFFF
+
+            yield cidr
+
+    @property
+    def value(self):
+        return self.count, self.digest
+
+class Topology(object):
+    """
+    The parsed state of one VPC, along with the blocks this container has handed out
+    """
+
+    def __init__(self, vpc_cidrs, findr, fingerprint):
+        self.vpc_cidrs = vpc_cidrs
+        self.findr = findr
+        self.fingerprint = fingerprint
+        self.allocations = []
+
+        # Blocks added to findr that discovery may not see yet: reservations
+        # made by other requests and blocks allocated before an Update
+        self.reserved = set()
+
+    def record(self, cidrs):
+        self.allocations.extend(cidrs)
+
+class TopologyCache(object):
+    """
+    A size-bounded LRU cache of Topology objects by VpcId whose entries expire after ttl seconds
+    """
+
+    def __init__(self, ttl=60, max_size=16, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+
+        self._entries = OrderedDict()
+
+    def get(self, vpc_id):
+        if vpc_id not in self._entries:
+            return None
+
+        created, topology = self._entries[vpc_id]
+
+        if self.clock() - created >= self.ttl:
+            del self._entries[vpc_id]
+            return None
+
+        self._entries.move_to_end(vpc_id)
+
+        return topology
+
+    def put(self, vpc_id, topology):
+        """
+        Store a topology, keeping the expiry time of any entry it replaces
+        """
+
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+
+        created = self._entries[vpc_id][0] if vpc_id in self._entries else self.clock()
+
+        self._entries[vpc_id] = (created, topology)
+        self._entries.move_to_end(vpc_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -8,120 +8,769 @@ http://aws.amazon.com/apache2.0/
 or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
 """
 
+from .profiling import profiled
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import chain
+from socket import AF_INET, AF_INET6, inet_ntoa, inet_ntop, inet_pton
+
 class CidrFindrException(Exception):
     pass
 
-class Range(object):
-    def __init__(self, base=None, top=None, size=None, cidr=None):
-        if cidr:
-            base, size = cidr.split("/")
+# Bound on the number of distinct strings each parsing cache remembers
+PARSE_CACHE_SIZE = 2 ** 16
 
-        if isinstance(base, str):
-            self.base = self.ip_to_num(base)
-        else:
-            self.base = base
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_ip(ip):
+    """
+    Parse an IPv4 or IPv6 address into (number, bits)
+    """
 
-        if size:
-            size = int(size)
+    try:
+        if ":" in ip:
+            return int.from_bytes(inet_pton(AF_INET6, ip), "big"), 128
 
-            self.top = self.base + 2 ** (32 - size)
-            self.size = size
-        elif top:
-            if isinstance(top, str):
-                self.top = self.ip_to_num(top)
-            else:
-                self.top = top
+        return int.from_bytes(inet_pton(AF_INET, ip), "big"), 32
+    except (OSError, TypeError):
+        raise CidrFindrException("Invalid IP address: {}".format(ip)) from None
 
-            self.size = math.log(self.top - self.bottom, 2)
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_cidr(cidr):
+    """
+    Parse a CIDR block into (base, size, bits), rejecting malformed blocks and set host bits
+    """
+
+    try:
+        address, size = cidr.split("/")
+
+        if ":" in address:
+            base = int.from_bytes(inet_pton(AF_INET6, address), "big")
+            bits = 128
         else:
-            raise CidrFindrException("Not enough information to determine IP range")
+            base = int.from_bytes(inet_pton(AF_INET, address), "big")
+            bits = 32
+    except (AttributeError, ValueError, OSError, TypeError):
+        raise CidrFindrException("Invalid CIDR block: {}".format(cidr)) from None
 
-    @staticmethod
-    def ip_to_num(ip):
-        ip = ip.split(".")
+    # isdigit() alone accepts other scripts' digits, and str.isascii() needs Python 3.7
+    if not size or any(c not in "0123456789" for c in size) or int(size) > bits:
+        raise CidrFindrException("Invalid CIDR block: {}".format(cidr))
 
-        num = 0
+    size = int(size)
 
-        for i in range(4):
-            num = num + int(ip[3 - i]) * (256 ** i)
+    if base & ((1 << (bits - size)) - 1):
+        raise CidrFindrException("Invalid CIDR block {}: host bits are set".format(cidr))
 
-        return num
+    return base, size, bits
 
-    @staticmethod
-    def num_to_ip(num):
-        ip = [0, 0, 0, 0]
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def format_ip(num, bits=32):
+    """
+    Format a number as an IPv4 or IPv6 address
+    """
 
-        for i in range(4):
-            ip[i] = str(num // (256 ** (3 - i)))
-            num = num % (256 ** (3 - i))
+    if bits == 128:
+        return inet_ntop(AF_INET6, num.to_bytes(16, "big"))
 
-        return ".".join(ip)
+    return inet_ntoa(num.to_bytes(4, "big"))
 
-    def overlaps(self, other):
-        if self.top > other.base and self.top < other.top:
-            return True
+def aligned_blocks(base, top, bits=32):
+    """
+    Split [base, top) into the fewest aligned CIDR blocks, yielding (base, size) pairs
+    """
+
+    while base < top:
+        block = base & -base if base else 1 << bits
+
+        while base + block > top:
+            block //= 2
+
+        yield base, bits + 1 - block.bit_length()
+
+        base += block
+
+def free_cidrs(runs, size, bits, offset=0, limit=None):
+    """
+    Expand (base, count) runs of aligned /size blocks into CIDR strings,
+    skipping the first `offset` blocks and stopping after `limit`.
+    Whole runs are skipped by count, so each CIDR yielded costs O(1).
+    """
+
+    if offset < 0:
+        raise CidrFindrException("Offset can't be negative: {}".format(offset))
 
-        if self.base >= other.base and self.base < other.top:
-            return True
+    if limit is not None and limit < 0:
+        raise CidrFindrException("Limit can't be negative: {}".format(limit))
 
-        if other.top > self.base and other.top < self.top:
-            return True
+    return _free_cidrs(runs, size, bits, offset, limit)
 
-        if other.base >= self.base and other.base < self.top:
-            return True
+def _free_cidrs(runs, size, bits, offset, limit):
+    block = 1 << (bits - size)
 
-        return False
+    for base, count in runs:
+        if offset >= count:
+            offset -= count
+            continue
+
+        base += offset * block
+        count -= offset
+        offset = 0
+
+        if limit is not None:
+            count = min(count, limit)
+            limit -= count
+
+        for i in range(count):
+            yield "{}/{}".format(format_ip(base + i * block, bits), size)
+
+        if limit == 0:
+            return
+
+class Range(object):
+    """
+    A CIDR block held as integers: base (inclusive), top (exclusive), prefix size,
+    and address width in bits (32 for IPv4, 128 for IPv6)
+    """
+
+    __slots__ = ("base", "top", "size", "bits")
+
+    def __init__(self, base=None, top=None, size=None, cidr=None, bits=32):
+        if cidr:
+            base, size, bits = parse_cidr(cidr)
+        elif isinstance(base, str):
+            base, bits = parse_ip(base)
+
+        if size is not None:
+            size = int(size)
+            top = base + (1 << (bits - size))
+        elif top is not None:
+            if isinstance(top, str):
+                top = parse_ip(top)[0]
+
+            span = top - base
+
+            if span <= 0 or span & (span - 1) or base & (span - 1):
+                raise CidrFindrException("{} to {} is not a CIDR block".format(self.num_to_ip(base, bits), self.num_to_ip(top, bits)))
+
+            size = bits + 1 - span.bit_length()
+        else:
+            raise CidrFindrException("Not enough information to determine IP range")
+
+        self.base = base
+        self.top = top
+        self.size = size
+        self.bits = bits
+
+    @property
+    def version(self):
+        return 6 if self.bits == 128 else 4
+
+    @staticmethod
+    def ip_to_num(ip):
+        return parse_ip(ip)[0]
+
+    @staticmethod
+    def num_to_ip(num, bits=32):
+        return format_ip(num, bits)
+
+    def overlaps(self, other):
+        # Two CIDR blocks overlap exactly when the larger one contains the other,
+        # i.e. their bases agree on the bits of the shorter prefix
+        return self.bits == other.bits and (self.base ^ other.base) >> (self.bits - min(self.size, other.size)) == 0
+
+    def contains(self, other):
+        return self.bits == other.bits and self.size <= other.size and (self.base ^ other.base) >> (self.bits - self.size) == 0
 
     def to_cidr(self):
-        return "{}/{}".format(self.num_to_ip(self.base), self.size)
+        return "{}/{}".format(format_ip(self.base, self.bits), self.size)
+
+    def __eq__(self, other):
+        return isinstance(other, Range) and self.base == other.base and self.size == other.size and self.bits == other.bits
+
+    def __hash__(self):
+        return hash((self.base, self.size, self.bits))
 
     def __str__(self):
         return self.to_cidr()
 
 class Network():
+    # Containers for the subnets and for the index columns, which subclasses
+    # may swap for more compact ones
+    subnet_store = list
+    index_store = list
+
+    # Whether add_subnet takes subnets in any order and sorts them in bulk later,
+    # so that CidrFindr can stream subnets to it rather than sort them all first
+    sorts_subnets = False
+
     def __init__(self, network, subnets):
         self.network = network
-        self.subnets = subnets
+        self.subnets = self.subnet_store()
+
+        # Sorted, merged [base, top) intervals of used address space, clipped to the network
+        self._bases = self.index_store()
+        self._tops = self.index_store()
+        self._gaps = None
+
+        # No block with a shorter prefix than this is free. Adding subnets or
+        # allocating only shrinks the free space, so it stays true until a release.
+        self._shortest_fit = network.size + 1
+
+        # Intervals of subnets added since the index was last brought up to date
+        self._pending = []
+
+        # Number of searches made for free space, for metrics
+        self.searches = 0
+
+        self.add_subnets(subnets)
+        self._reindex()
+
+    def add_subnet(self, subnet):
+        """
+        Record an existing subnet; the index catches up before the next search
+        """
+
+        self.subnets.append(subnet)
+        self._pending.append((subnet.base, subnet.top))
+
+    def add_subnets(self, subnets):
+        for subnet in subnets:
+            self.add_subnet(subnet)
+
+    def _flush(self):
+        if self._pending:
+            self._reindex()
+
+    def _reindex(self):
+        """
+        Merge the pending intervals into the index in one sort
+        """
+
+        intervals = self._pending
+        intervals.extend(zip(self._bases, self._tops))
+        intervals.sort()
+
+        self._pending = []
+        self._bases = self.index_store()
+        self._tops = self.index_store()
+        self._gaps = None
+
+        for base, top in intervals:
+            base = max(base, self.network.base)
+            top = min(top, self.network.top)
+
+            if base >= top:
+                continue
+
+            if self._tops and base <= self._tops[-1]:
+                self._tops[-1] = max(self._tops[-1], top)
+            else:
+                self._bases.append(base)
+                self._tops.append(top)
+
+        self._rebuild()
+
+    def _rebuild(self):
+        """
+        Hook for subclasses that keep their own view of the free space
+        """
+
+    def _use(self, base, top):
+        """
+        Mark [base, top) as used, merging it with any touching intervals
+        """
+
+        base = max(base, self.network.base)
+        top = min(top, self.network.top)
+
+        if base >= top:
+            return
+
+        start = bisect_left(self._tops, base)
+        end = bisect_right(self._bases, top)
+
+        if start < end:
+            base = min(base, self._bases[start])
+            top = max(top, self._tops[end - 1])
+
+            del self._bases[start:end]
+            del self._tops[start:end]
+
+        self._bases.insert(start, base)
+        self._tops.insert(start, top)
+
+        self._gaps = None
+
+    def _unuse(self, base, top):
+        """
+        Mark [base, top) as free, splitting any interval it cuts through
+        """
+
+        base = max(base, self.network.base)
+        top = min(top, self.network.top)
+
+        if base >= top:
+            return
+
+        start = bisect_right(self._tops, base)
+        end = bisect_left(self._bases, top)
+
+        if start >= end:
+            return
+
+        first = self._bases[start]
+        last = self._tops[end - 1]
+
+        del self._bases[start:end]
+        del self._tops[start:end]
+
+        if top < last:
+            self._bases.insert(start, top)
+            self._tops.insert(start, last)
+
+        if first < base:
+            self._bases.insert(start, first)
+            self._tops.insert(start, base)
+
+        self._gaps = None
+
+    def free_gaps(self):
+        """
+        Return the [base, top) intervals of the network that no subnet uses
+        """
+
+        self._flush()
+
+        if self._gaps is None:
+            gaps = []
+            position = self.network.base
+
+            for base, top in zip(self._bases, self._tops):
+                if base > position:
+                    gaps.append((position, base))
+
+                position = top
+
+            if position < self.network.top:
+                gaps.append((position, self.network.top))
+
+            self._gaps = gaps
+
+        return self._gaps
+
+    def free_addresses(self):
+        """
+        Return the number of addresses in the network that no subnet uses
+        """
+
+        return sum(top - base for base, top in self.free_gaps())
+
+    def free_blocks(self):
+        """
+        Return the number of free CIDR blocks of each prefix length, splitting
+        every gap into the fewest aligned blocks
+        """
+
+        blocks = {}
+
+        for start, end in self.free_gaps():
+            for _, size in aligned_blocks(start, end, self.network.bits):
+                blocks[size] = blocks.get(size, 0) + 1
+
+        return blocks
+
+    def largest_free_prefix(self):
+        """
+        Return the shortest prefix length that could still be allocated, or None when none can.
+        A subnet must be smaller than its network, so an empty network offers its two halves.
+        """
+
+        largest = min(self.free_blocks(), default=None)
+
+        if largest is not None:
+            largest = max(largest, self.network.size + 1)
+
+            if largest > self.network.bits:
+                largest = None
+
+        self._shortest_fit = largest if largest is not None else self.network.bits + 1
+
+        return largest
+
+    def fragmentation(self):
+        """
+        Return the share of free addresses outside the largest free block:
+        0.0 when free space is contiguous, approaching 1.0 as it splinters
+        """
+
+        free = self.free_addresses()
+        largest = min(self.free_blocks(), default=None)
+
+        if not free:
+            return 0.0
+
+        return 1 - (1 << (self.network.bits - largest)) / free
+
+    def _free_runs(self, size):
+        """
+        Yield (base, count) for the aligned /size blocks free in each gap, in address order
+        """
+
+        # Like next_subnet, a subnet must be smaller than its network
+        if size <= self.network.size or size < self._shortest_fit:
+            return
+
+        block = 1 << (self.network.bits - size)
+
+        for start, end in self.free_gaps():
+            base = self.network.base + -(-(start - self.network.base) // block) * block
+
+            if base + block <= end:
+                yield base, (end - base) // block
+
+    def iter_free(self, size, offset=0, limit=None):
+        """
+        Lazily yield every free /size CIDR in address order without allocating
+        any of them, skipping the first `offset` and stopping after `limit`.
+        Allocating or releasing while iterating may or may not be reflected.
+        """
+
+        if size > self.network.bits:
+            raise CidrFindrException("/{} is not a valid IPv{} prefix".format(size, self.network.version))
+
+        return free_cidrs(self._free_runs(size), size, self.network.bits, offset, limit)
+
+    def _find(self, req):
+        """
+        Return the lowest aligned base with room for a /req, or None
+        """
+
+        block = 1 << (self.network.bits - req)
+
+        for start, end in self.free_gaps():
+            base = self.network.base + -(-(start - self.network.base) // block) * block
+
+            if base + block <= end:
+                return base
+
+        return None
 
     def next_subnet(self, req):
         if req <= self.network.size:
             raise CidrFindrException("Can't fit a /{} subnet in a /{} network".format(req, self.network.size))
 
-        for base in range(self.network.base, self.network.top, 2 ** (32 - req)):
-            attempt = Range(base=base, size=req)
+        if req > self.network.bits:
+            raise CidrFindrException("/{} is not a valid IPv{} prefix".format(req, self.network.version))
+
+        cidr = self.try_next_subnet(req)
+
+        if cidr is None:
+            raise CidrFindrException("Not enough space for a /{} in {}".format(req, self.network.to_cidr()))
+
+        return cidr
 
-            if attempt.top > self.network.top:
-                break
+    def try_next_subnet(self, req):
+        """
+        Allocate a /req like next_subnet, but return None rather than raising when it
+        doesn't fit. Requests known not to fit are turned away without a search.
+        """
 
-            if not any(attempt.overlaps(subnet) for subnet in self.subnets):
-                self.subnets.append(attempt)
-                return attempt.to_cidr()
+        if req <= self.network.size or req < self._shortest_fit or req > self.network.bits:
+            return None
 
-        raise CidrFindrException("Not enough space for a /{} in {}".format(req, self.network.to_cidr()))
+        self._flush()
+
+        self.searches += 1
+        base = self._find(req)
+
+        if base is None:
+            # Nothing this size is free, so nothing larger is either
+            self._shortest_fit = req + 1
+            return None
+
+        attempt = Range(base=base, size=req, bits=self.network.bits)
+
+        self.subnets.append(attempt)
+        self._use(attempt.base, attempt.top)
+
+        return attempt.to_cidr()
+
+    def release(self, cidr):
+        """
+        Return a previously allocated subnet to the free space
+        """
+
+        released = Range(cidr=cidr)
+
+        self._flush()
+
+        if released not in self.subnets:
+            raise CidrFindrException("{} is not allocated in {}".format(cidr, self.network.to_cidr()))
+
+        self.subnets.remove(released)
+
+        self._unuse(released.base, released.top)
+        self._shortest_fit = self.network.size + 1
+
+        # Anything else still holding part of the range keeps it
+        for subnet in self._overlapping(released):
+            self._use(subnet.base, subnet.top)
+
+    def _overlapping(self, cidr):
+        """
+        Yield the subnets that overlap a Range
+        """
+
+        for subnet in self.subnets:
+            if subnet.overlaps(cidr):
+                yield subnet
+
+# Above this many subnets, a network of at most BITMAP_MAX_UNITS /28s is
+# searched with the NumPy bitmap engine when NumPy is installed
+BITMAP_MIN_SUBNETS = 256
+BITMAP_MAX_UNITS = 2 ** 20
+
+def select_network_class(network, subnets):
+    """
+    Pick the allocator best suited to the size and density of a network
+    """
+
+    units = 2 ** (28 - network.size) if network.bits == 32 and network.size <= 28 else 0
+
+    if len(subnets) >= BITMAP_MIN_SUBNETS and 0 < units <= BITMAP_MAX_UNITS and len(subnets) * 64 >= units:
+        try:
+            from .bitmap import BitmapNetwork
+        except ImportError:
+            return Network
+
+        return BitmapNetwork
+
+    return Network
 
 class CidrFindr():
-    def __init__(self, network=None, networks=[], subnets=[]):
+    def __init__(self, network=None, networks=[], subnets=[], network_class=None):
         if network:
             networks = [network]
 
-        networks = [Range(cidr=network) for network in sorted(networks)]
+        # Numeric order, IPv4 before IPv6, so that first fit means lowest address
+        networks = sorted((Range(cidr=network) for network in networks), key=lambda network: (network.bits, network.base, network.size))
 
-        subnets = [
-            Range(cidr=subnet)
-            for subnet
-            in sorted(subnets)
-        ]
+        self.network_class = network_class
 
-        self.networks = [
-            Network(network, [subnet for subnet in subnets if subnet.overlaps(network)])
-            for network in networks
-        ]
+        if network_class is not None and network_class.sorts_subnets:
+            self.networks = [network_class(network, []) for network in networks]
+            self._stream_subnets(subnets)
+            return
 
-    def next_subnet(self, req):
+        subnets = sorted((Range(cidr=subnet) for subnet in subnets), key=lambda subnet: (subnet.bits, subnet.base))
+
+        self.networks = []
+
+        # Sweep both lists together. carried holds the subnets reached so far that
+        # could still overlap this network or a later one; a subnet that spans
+        # several networks stays in it until the sweep passes its top, and one
+        # outside every network is dropped.
+        carried = []
+        position = 0
+
+        for network in networks:
+            while position < len(subnets) and (subnets[position].bits, subnets[position].base) < (network.bits, network.top):
+                carried.append(subnets[position])
+                position += 1
+
+            carried = [subnet for subnet in carried if subnet.bits == network.bits and subnet.top > network.base]
+
+            network_subnets = [subnet for subnet in carried if subnet.base < network.top]
+
+            cls = network_class or select_network_class(network, network_subnets)
+
+            self.networks.append(cls(network, network_subnets))
+
+    def _stream_subnets(self, subnets):
+        """
+        Hand each subnet to the networks it overlaps as it is parsed, without
+        keeping a Range for every subnet or filling the parse cache with them
+        """
+
+        parse = parse_cidr.__wrapped__
+
+        for subnet in subnets:
+            base, size, bits = parse(subnet)
+            subnet = Range(base=base, size=size, bits=bits)
+
+            for network in self.networks:
+                if network.network.overlaps(subnet):
+                    network.add_subnet(subnet)
+
+    def add_subnets(self, subnets):
+        """
+        Add existing subnets to the networks they overlap, e.g. one page of discovery at a time
+        """
+
+        for subnet in subnets:
+            subnet = Range(cidr=subnet)
+
+            for network in self.networks:
+                if network.network.overlaps(subnet):
+                    network.add_subnet(subnet)
+
+        # A network that has filled up may now suit a different allocator
+        if self.network_class is None:
+            for i, network in enumerate(self.networks):
+                cls = select_network_class(network.network, network.subnets)
+
+                if type(network) is Network and cls is not Network:
+                    self.networks[i] = cls(network.network, network.subnets)
+
+    @profiled("next_subnet")
+    def next_subnet(self, req, version=4):
         for network in self.networks:
-            try:
-                return network.next_subnet(req)
-            except CidrFindrException:
-                pass
+            if network.network.version != version:
+                continue
+
+            # Networks known to be too full return None without searching
+            cidr = network.try_next_subnet(req)
+
+            if cidr is not None:
+                return cidr
+
+        raise self._not_enough_space(version)
+
+    def snapshot(self):
+        """
+        Return the state of the networks as a compact binary snapshot
+        """
+
+        from .snapshot import dumps
+
+        return dumps(self)
+
+    @classmethod
+    def from_snapshot(cls, data):
+        """
+        Rebuild a CidrFindr from a snapshot without parsing any CIDR strings
+        """
+
+        from .snapshot import loads
+
+        return loads(data)
+
+    def _not_enough_space(self, version):
+        largest = self.largest_free_prefix(version)
+
+        if largest is None:
+            return CidrFindrException("Not enough space for the requested CIDR blocks: no free space left")
+
+        return CidrFindrException("Not enough space for the requested CIDR blocks: a /{} or smaller would fit".format(largest))
 
-        raise CidrFindrException("Not enough space for the requested CIDR blocks")
+    def _version_networks(self, version):
+        return [network for network in self.networks if network.network.version == version]
+
+    def free_addresses(self, version=4):
+        """
+        Return the number of unused addresses across all networks of an IP version
+        """
+
+        return sum(network.free_addresses() for network in self._version_networks(version))
+
+    def free_blocks(self, version=4):
+        """
+        Return the number of free CIDR blocks of each prefix length across all networks of an IP version
+        """
+
+        blocks = {}
+
+        for network in self._version_networks(version):
+            for size, count in network.free_blocks().items():
+                blocks[size] = blocks.get(size, 0) + count
+
+        return blocks
+
+    def iter_free(self, size, version=4, offset=0, limit=None):
+        """
+        Lazily yield every free /size CIDR across all networks of an IP version,
+        in address order and without allocating any of them, skipping the
+        first `offset` and stopping after `limit`
+        """
+
+        bits = 128 if version == 6 else 32
+
+        if size > bits:
+            raise CidrFindrException("/{} is not a valid IPv{} prefix".format(size, version))
+
+        runs = chain.from_iterable(network._free_runs(size) for network in self._version_networks(version))
+
+        return free_cidrs(runs, size, bits, offset, limit)
+
+    def largest_free_prefix(self, version=4):
+        """
+        Return the shortest prefix length that could still be allocated in any network, or None when none can
+        """
+
+        prefixes = (network.largest_free_prefix() for network in self._version_networks(version))
+
+        return min((prefix for prefix in prefixes if prefix is not None), default=None)
+
+    def fragmentation(self, version=4):
+        """
+        Return the share of free addresses outside the single largest free block
+        """
+
+        free = self.free_addresses(version)
+        largest = min(self.free_blocks(version), default=None)
+
+        if not free:
+            return 0.0
+
+        bits = 128 if version == 6 else 32
+
+        return 1 - (1 << (bits - largest)) / free
+
+    @property
+    def searches(self):
+        """
+        The number of networks searched for free space so far
+        """
+
+        return sum(network.searches for network in self.networks)
+
+    def release(self, cidr):
+        """
+        Free a subnet so that later requests can reuse its space
+        """
+
+        released = Range(cidr=cidr)
+        found = False
+
+        for network in self.networks:
+            if network.network.overlaps(released):
+                try:
+                    network.release(cidr)
+                    found = True
+                except CidrFindrException:
+                    pass
+
+        if not found:
+            raise CidrFindrException("{} is not allocated".format(cidr))
+
+    def next_subnets(self, reqs, version=4):
+        """
+        Allocate a batch of subnets, largest first, returning them in the order requested.
+        Nothing is allocated unless every request fits.
+        """
+
+        reqs = list(reqs)
+        result = [None] * len(reqs)
+
+        try:
+            for i in sorted(range(len(reqs)), key=lambda i: reqs[i]):
+                result[i] = self.next_subnet(reqs[i], version)
+        except CidrFindrException:
+            for cidr in result:
+                if cidr is not None:
+                    self.release(cidr)
+
+            # Report what fits once the partial allocation is undone
+            raise self._not_enough_space(version)
+
+        return result
@@ -0,0 +1,202 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+Plan subnets for many VPCs offline from saved describe-vpcs and describe-subnets output:
+
+    aws ec2 describe-vpcs > vpcs.json
+    aws ec2 describe-subnets > subnets.json
+    python -m cidr_findr --vpcs vpcs.json --subnets subnets.json requests.jsonl
+
+Each input line is a JSON object with a VpcId and the Sizes (and optionally
+Ipv6Sizes) to allocate in it. A line may carry its own "Vpc" and "Subnets"
+entries in describe-vpcs/describe-subnets form instead of relying on the dumps.
+One JSON line is written per input line, in the same order.
+"""
+
+from .cidr_findr import CidrFindr, CidrFindrException
+from .discovery import subnet_cidrs, vpc_cidrs
+from .lambda_utils import ipv6_sizes_valid, parse_size, sizes_valid
+from collections import deque
+import argparse
+import json
+import os
+import sys
+import time
+
+def load_dumps(vpc_files, subnet_files):
+    """
+    Index the CIDR blocks in describe-vpcs and describe-subnets output by VpcId
+    """
+
+    vpcs = {}
+    subnets = {}
+
+    for path in vpc_files:
+        with open(path) as f:
+            for vpc in json.load(f)["Vpcs"]:
+                vpcs[vpc["VpcId"]] = vpc_cidrs(vpc)
+
+    for path in subnet_files:
+        with open(path) as f:
+            for subnet in json.load(f)["Subnets"]:
+                subnets.setdefault(subnet["VpcId"], []).extend(subnet_cidrs(subnet))
+
+    return vpcs, subnets
+
+def make_task(request, vpcs, subnets):
+    """
+    Resolve one input line to (vpc_id, vpc CIDRs, subnet CIDRs, sizes, IPv6 sizes)
+    """
+
+    vpc_id = request.get("VpcId")
+
+    if "Vpc" in request:
+        vpc = vpc_cidrs(request["Vpc"])
+    else:
+        vpc = vpcs.get(vpc_id)
+
+    if "Subnets" in request:
+        existing = [cidr for subnet in request["Subnets"] for cidr in subnet_cidrs(subnet)]
+    else:
+        existing = subnets.get(vpc_id, [])
+
+    return vpc_id, vpc, existing, request.get("Sizes", []), request.get("Ipv6Sizes", [])
+
+def parse_task(line, vpcs, subnets):
+    """
+    Resolve one input line to a task, or to the error line to write for it
+    """
+
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return {"Error": "Invalid JSON: {}".format(e)}
+
+    if not isinstance(request, dict):
+        return {"Error": "Invalid request: expected a JSON object"}
+
+    try:
+        return make_task(request, vpcs, subnets)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return {"VpcId": request.get("VpcId"), "Error": "Invalid request: {}: {}".format(type(e).__name__, e)}
+
+def plan(task):
+    """
+    Allocate the requested blocks in one VPC, returning the output line as a dict.
+    A task that is already an error line is passed through.
+    """
+
+    if isinstance(task, dict):
+        return task
+
+    vpc_id, vpc, existing, sizes, ipv6_sizes = task
+
+    result = {"VpcId": vpc_id}
+
+    if vpc is None:
+        result["Error"] = "Unknown VPC: {}".format(vpc_id)
+        return result
+
+    try:
+        parsed_sizes = tuple(map(parse_size, sizes))
+        parsed_ipv6_sizes = tuple(map(parse_size, ipv6_sizes))
+
+        if not sizes_valid(parsed_sizes):
+            result["Error"] = "An invalid subnet size was specified: {}".format(", ".join(map(str, sizes)))
+            return result
+
+        if not ipv6_sizes_valid(parsed_ipv6_sizes):
+            result["Error"] = "An invalid IPv6 subnet size was specified: {}".format(", ".join(map(str, ipv6_sizes)))
+            return result
+
+        findr = CidrFindr(networks=vpc, subnets=existing)
+
+        result["CidrBlocks"] = findr.next_subnets(parsed_sizes)
+        result["Ipv6CidrBlocks"] = findr.next_subnets(parsed_ipv6_sizes, version=6)
+    except CidrFindrException as e:
+        result = {"VpcId": vpc_id, "Error": str(e)}
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        result = {"VpcId": vpc_id, "Error": "Invalid request: {}: {}".format(type(e).__name__, e)}
+
+    return result
+
+def run(tasks, workers, window):
+    """
+    Yield the plan for each task in order, running up to `window` tasks ahead on a process pool
+    """
+
+    if workers <= 0:
+        for task in tasks:
+            yield plan(task)
+
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        for task in tasks:
+            pending.append(pool.submit(plan, task))
+
+            # Bound the work in flight so that input is read no faster than it is planned
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cidr_findr", description="Plan subnets for many VPCs from saved AWS CLI output")
+    parser.add_argument("input", nargs="?", default="-", help="JSON lines of requests (default: standard input)")
+    parser.add_argument("--output", default="-", help="where to write the JSON lines of results (default: standard output)")
+    parser.add_argument("--vpcs", action="append", default=[], help="describe-vpcs output; may be given more than once")
+    parser.add_argument("--subnets", action="append", default=[], help="describe-subnets output; may be given more than once")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, or 0 to plan in this process")
+    parser.add_argument("--window", type=int, default=0, help="requests in flight (default: 4 per worker)")
+    args = parser.parse_args(argv)
+
+    vpcs, subnets = load_dumps(args.vpcs, args.subnets)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    sink = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    window = args.window or 4 * max(args.workers, 1)
+
+    count = 0
+    failed = 0
+    start = time.perf_counter()
+
+    try:
+        tasks = (parse_task(line, vpcs, subnets) for line in source if line.strip())
+
+        for result in run(tasks, args.workers, window):
+            count += 1
+            failed += "Error" in result
+
+            sink.write(json.dumps(result) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+        if sink is not sys.stdout:
+            sink.close()
+        else:
+            sink.flush()
+
+    elapsed = time.perf_counter() - start
+
+    print("Planned {} VPCs ({} failed) in {:.3f}s: {:.1f} VPCs/s".format(
+        count,
+        failed,
+        elapsed,
+        count / elapsed if elapsed else 0.0,
+    ), file=sys.stderr)
+
+    return 1 if failed else 0
@@ -0,0 +1,265 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from .cidr_findr import CidrFindrException, Network, Range
+from array import array
+from bisect import bisect_left
+from functools import partial
+from heapq import merge
+
+# Deferred subnets are sorted this many at a time and the runs merged, so that
+# sorting a million of them never holds a million int objects at once
+SORT_CHUNK = 1 << 14
+
+class SubnetColumns(object):
+    """
+    A sorted sequence of IPv4 subnets kept as two packed columns, a uint32 base
+    and a byte of prefix length, rather than as Range objects: about 5 bytes
+    a subnet instead of a couple of hundred. Ranges are made as they are read.
+
+    Subnets added with defer() are sorted in on the next read, so that loading
+    many of them costs one sort rather than one insert each.
+    """
+
+    def __init__(self):
+        self.bases = array("I")
+        self.sizes = array("B")
+
+        # base << 8 | size of the deferred subnets
+        self._pending = array("Q")
+
+    def defer(self, subnet):
+        self._pending.append(subnet.base << 8 | subnet.size)
+
+    def _merge(self):
+        if not self._pending:
+            return
+
+        pending = self._pending
+        self._pending = array("Q")
+
+        runs = [array("Q", sorted(pending[i:i + SORT_CHUNK])) for i in range(0, len(pending), SORT_CHUNK)]
+        del pending
+
+        bases = array("I")
+        sizes = array("B")
+
+        current = (base << 8 | size for base, size in zip(self.bases, self.sizes))
+
+        for key in merge(current, *runs):
+            bases.append(key >> 8)
+            sizes.append(key & 0xFF)
+
+        self.bases = bases
+        self.sizes = sizes
+
+    def _index(self, subnet):
+        """
+        Return the position of a subnet, or -1
+        """
+
+        self._merge()
+
+        i = bisect_left(self.bases, subnet.base)
+
+        while i < len(self.bases) and self.bases[i] == subnet.base:
+            if self.sizes[i] == subnet.size:
+                return i
+
+            i += 1
+
+        return -1
+
+    def append(self, subnet):
+        """
+        Add a subnet in its sorted position
+        """
+
+        self._merge()
+
+        i = bisect_left(self.bases, subnet.base)
+
+        while i < len(self.bases) and self.bases[i] == subnet.base and self.sizes[i] < subnet.size:
+            i += 1
+
+        self.bases.insert(i, subnet.base)
+        self.sizes.insert(i, subnet.size)
+
+    def remove(self, subnet):
+        i = self._index(subnet)
+
+        if i < 0:
+            raise ValueError("{} is not in the subnets".format(subnet))
+
+        del self.bases[i]
+        del self.sizes[i]
+
+    def overlapping(self, cidr):
+        """
+        Yield the subnets that overlap a Range, found by bisecting the columns
+        """
+
+        self._merge()
+
+        # Subnets that start inside the range
+        i = bisect_left(self.bases, cidr.base)
+
+        while i < len(self.bases) and self.bases[i] < cidr.top:
+            yield self[i]
+            i += 1
+
+        # Larger subnets that start before it can only start on one of its
+        # shorter prefixes' boundaries
+        starts = sorted({cidr.base >> (32 - size) << (32 - size) for size in range(cidr.size)})
+
+        for base in starts:
+            if base == cidr.base:
+                continue
+
+            i = bisect_left(self.bases, base)
+
+            while i < len(self.bases) and self.bases[i] == base:
+                if base + (1 << (32 - self.sizes[i])) > cidr.base:
+                    yield self[i]
+
+                i += 1
+
+    def intervals(self):
+        """
+        Yield the (base, top) of each subnet in order
+        """
+
+        self._merge()
+
+        for base, size in zip(self.bases, self.sizes):
+            yield base, base + (1 << (32 - size))
+
+    def __contains__(self, subnet):
+        return isinstance(subnet, Range) and subnet.bits == 32 and self._index(subnet) >= 0
+
+    def __getitem__(self, i):
+        self._merge()
+
+        return Range(base=self.bases[i], size=self.sizes[i], bits=32)
+
+    def __iter__(self):
+        self._merge()
+
+        for base, size in zip(self.bases, self.sizes):
+            yield Range(base=base, size=size, bits=32)
+
+    def __len__(self):
+        return len(self.bases) + len(self._pending)
+
+class ArrayNetwork(Network):
+    """
+    An IPv4 Network that stores its subnets in SubnetColumns and its index of
+    used space in packed arrays, for address plans with millions of subnets.
+    Allocation works as in a plain Network, with the same answers.
+    """
+
+    subnet_store = SubnetColumns
+    index_store = partial(array, "Q")
+    sorts_subnets = True
+
+    def __init__(self, network, subnets):
+        if network.bits != 32:
+            raise CidrFindrException("{} is not an IPv4 network".format(network.to_cidr()))
+
+        self._stale = False
+
+        super().__init__(network, subnets)
+
+    @classmethod
+    def from_columns(cls, network, bases, sizes):
+        """
+        Make a network straight from a uint32 array of subnet bases and a byte
+        array of their prefixes, already sorted by base then prefix
+        """
+
+        self = cls(network, [])
+
+        self.subnets.bases = bases
+        self.subnets.sizes = sizes
+        self._reindex()
+
+        return self
+
+    def add_subnet(self, subnet):
+        self.subnets.defer(subnet)
+        self._stale = True
+
+    def _flush(self):
+        if self._stale:
+            self._reindex()
+
+    def _reindex(self):
+        """
+        Rebuild the index from the subnets, which are already in order
+        """
+
+        # This runs once per subnet when loading millions of them, so the
+        # bounds and the last top are held locally
+        lowest = self.network.base
+        highest = self.network.top
+
+        bases = self.index_store()
+        tops = self.index_store()
+        last = -1
+
+        for base, top in self.subnets.intervals():
+            if base < lowest:
+                base = lowest
+
+            if top > highest:
+                top = highest
+
+            if base >= top:
+                continue
+
+            if base <= last:
+                if top > last:
+                    last = tops[-1] = top
+            else:
+                bases.append(base)
+                tops.append(top)
+                last = top
+
+        self._bases = bases
+        self._tops = tops
+        self._gaps = None
+        self._stale = False
+
+        self._rebuild()
+
+    def free_gaps(self):
+        """
+        Return an iterator over the free [base, top) intervals, read straight
+        from the index rather than kept as a list of tuples
+        """
+
+        self._flush()
+
+        return self._iter_gaps()
+
+    def _iter_gaps(self):
+        position = self.network.base
+
+        for base, top in zip(self._bases, self._tops):
+            if base > position:
+                yield position, base
+
+            position = top
+
+        if position < self.network.top:
+            yield position, self.network.top
+
+    def _overlapping(self, cidr):
+        return self.subnets.overlapping(cidr)
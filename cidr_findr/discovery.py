@@ -0,0 +1,184 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from queue import Empty, Full, Queue
+import threading
+
+# Threads shared by every invocation in the container: enough to run
+# describe_vpcs alongside the describe_subnets pages
+DISCOVERY_THREADS = 4
+
+# Pages of subnets fetched ahead of the allocator
+PREFETCH_PAGES = 4
+
+# The most values EC2 accepts in one filter
+VPC_IDS_PER_FILTER = 200
+
+executor = None
+
+def get_executor():
+    """
+    Return the shared discovery thread pool, creating it on first use
+    """
+
+    global executor
+
+    if executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=DISCOVERY_THREADS, thread_name_prefix="cidr-findr")
+
+    return executor
+
+def describe_vpc_cidrs(client, vpc_id):
+    """
+    Return the IPv4 and IPv6 CIDR blocks of a VPC
+    """
+
+    return vpc_cidrs(client.describe_vpcs(VpcIds=[vpc_id])["Vpcs"][0])
+
+def vpc_cidrs(vpc):
+    """
+    Return the IPv4 and IPv6 CIDR blocks of a VPC from its describe_vpcs entry
+    """
+
+    return [
+        cidr_block_association["CidrBlock"]
+        for cidr_block_association
+        in vpc["CidrBlockAssociationSet"]
+    ] + [
+        cidr_block_association["Ipv6CidrBlock"]
+        for cidr_block_association
+        in vpc.get("Ipv6CidrBlockAssociationSet", [])
+    ]
+
+def subnet_cidrs(subnet):
+    """
+    Return the IPv4 and IPv6 CIDR blocks of a subnet
+    """
+
+    cidrs = [subnet["CidrBlock"]] if "CidrBlock" in subnet else []
+
+    for cidr_block_association in subnet.get("Ipv6CidrBlockAssociationSet", []):
+        cidrs.append(cidr_block_association["Ipv6CidrBlock"])
+
+    return cidrs
+
+def iter_subnet_pages(client, vpc_id):
+    """
+    Yield the CIDR blocks of the subnets in a VPC as one list per describe_subnets page
+    """
+
+    paginator = client.get_paginator("describe_subnets")
+
+    for page in paginator.paginate(Filters=[{"Name": "vpc-id", "Values": [vpc_id]}]):
+        yield [cidr for subnet in page["Subnets"] for cidr in subnet_cidrs(subnet)]
+
+def iter_subnet_cidrs(client, vpc_id):
+    """
+    Yield the CIDR blocks of every subnet in a VPC, fetching a page at a time
+    """
+
+    for page in iter_subnet_pages(client, vpc_id):
+        for cidr in page:
+            yield cidr
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def describe_vpcs_cidrs(client, vpc_ids):
+    """
+    Return {VpcId: CIDR blocks} for many VPCs, a filter's worth of VpcIds per call.
+    VPCs that don't exist are left out rather than failing the call.
+    """
+
+    result = {}
+    paginator = client.get_paginator("describe_vpcs")
+
+    for chunk in _chunks(vpc_ids, VPC_IDS_PER_FILTER):
+        for page in paginator.paginate(Filters=[{"Name": "vpc-id", "Values": chunk}]):
+            for vpc in page["Vpcs"]:
+                result[vpc["VpcId"]] = vpc_cidrs(vpc)
+
+    return result
+
+def group_subnet_cidrs(client, vpc_ids):
+    """
+    Return {VpcId: subnet CIDR blocks} for many VPCs, listing their subnets together
+    """
+
+    result = {vpc_id: [] for vpc_id in vpc_ids}
+    paginator = client.get_paginator("describe_subnets")
+
+    for chunk in _chunks(vpc_ids, VPC_IDS_PER_FILTER):
+        for page in paginator.paginate(Filters=[{"Name": "vpc-id", "Values": chunk}]):
+            for subnet in page["Subnets"]:
+                result.setdefault(subnet["VpcId"], []).extend(subnet_cidrs(subnet))
+
+    return result
+
+class Prefetch(object):
+    """
+    Iterate over an iterable on a pool thread, keeping up to `size` items ready.
+    Errors are raised in the consuming thread. close() stops the producer.
+    """
+
+    _ITEM, _DONE, _ERROR = range(3)
+
+    def __init__(self, executor, iterable, size=PREFETCH_PAGES):
+        self._queue = Queue(maxsize=size)
+        self._stopped = threading.Event()
+        self._finished = False
+
+        executor.submit(self._produce, iterable)
+
+    def _put(self, message):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(message, timeout=0.1)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put((self._ITEM, item)):
+                    return
+        except Exception as e:
+            self._put((self._ERROR, e))
+        else:
+            self._put((self._DONE, None))
+
+    def __iter__(self):
+        while not self._finished:
+            kind, value = self._queue.get()
+
+            if kind == self._ITEM:
+                yield value
+                continue
+
+            self._finished = True
+
+            if kind == self._ERROR:
+                raise value
+
+    def close(self):
+        self._stopped.set()
+
+        # Unblock a producer waiting on a full queue
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Empty:
+            pass
@@ -10,20 +10,354 @@ or in the "license" file accompanying this file. This file is distributed on an
 
 
 from . import CidrFindr, CidrFindrException
-from .lambda_utils import parse_size, send_response, sizes_valid
-import boto3
+from .cache import Fingerprint, Topology, TopologyCache
+from .cidr_findr import format_ip, parse_cidr
+from .discovery import Prefetch, describe_vpc_cidrs, describe_vpcs_cidrs, get_executor, group_subnet_cidrs, iter_subnet_pages
+from .lambda_utils import ipv6_sizes_valid, parse_size, send_response, sizes_valid
+from .metrics import NULL_METRICS, new_metrics
+from .profiling import profiled
+from contextlib import closing
+from itertools import chain
+import os
 
-ec2 = boto3.client("ec2")
+# Created on first use so that importing the package doesn't pay for boto3
+ec2 = None
 
-def handler(event, context, responder=send_response, client=ec2):
+# Successful responses by (RequestId, LogicalResourceId), so that a request
+# CloudFormation sends again gets the same blocks. TopologyCache is a plain
+# TTL and LRU map, so it serves here too.
+response_cache = TopologyCache(ttl=3600, max_size=256)
+
+# Created on first use when CIDR_FINDR_RESERVATIONS names a ledger
+reservations = None
+
+# How many times to start over when another request reserves blocks first
+RESERVE_ATTEMPTS = 5
+
+# CloudFormation rejects longer physical ids
+MAX_PHYSICAL_ID_LENGTH = 1024
+
+# Parsed VPC state kept while the container is warm
+topology_cache = TopologyCache(
+    ttl=float(os.environ.get("CIDR_FINDR_CACHE_TTL", 60)),
+    max_size=int(os.environ.get("CIDR_FINDR_CACHE_SIZE", 16)),
+)
+
+def get_reservations():
+    """
+    Return the shared reservation ledger named by CIDR_FINDR_RESERVATIONS, or None when it isn't set
+    """
+
+    global reservations
+
+    path = os.environ.get("CIDR_FINDR_RESERVATIONS")
+
+    if not path:
+        return None
+
+    if reservations is None:
+        from .reservations import SqliteReservations
+
+        reservations = SqliteReservations(path, ttl=float(os.environ.get("CIDR_FINDR_RESERVATION_TTL", 600)))
+
+    return reservations
+
+def get_ec2_client():
+    """
+    Return the shared EC2 client, creating it on first use
+    """
+
+    global ec2
+
+    if ec2 is None:
+        import boto3
+
+        ec2 = boto3.client("ec2")
+
+    return ec2
+
+def load_topology(client, vpc_id, cache=None, metrics=NULL_METRICS):
+    """
+    Return the Topology of a VPC, reusing the cached one while its CIDRs are unchanged.
+    describe_vpcs runs alongside the describe_subnets pages.
+    """
+
+    topology = cache.get(vpc_id) if cache is not None else None
+
+    executor = get_executor()
+
+    def describe_vpcs():
+        with metrics.span("DescribeVpcs"):
+            return describe_vpc_cidrs(client, vpc_id)
+
+    vpc_cidrs = executor.submit(describe_vpcs)
+    subnet_pages = Prefetch(executor, metrics.timed("DescribeSubnets", iter_subnet_pages(client, vpc_id)))
+
+    with closing(subnet_pages):
+        vpc_cidrs = vpc_cidrs.result()
+        fingerprint = Fingerprint()
+        subnet_cidrs = fingerprint.track(chain.from_iterable(subnet_pages))
+
+        if topology is not None and topology.vpc_cidrs == vpc_cidrs:
+            # Keep the CIDRs so that if the subnets have changed, the VPC is
+            # rebuilt from this listing rather than by listing it again
+            subnet_cidrs = list(subnet_cidrs)
+
+            if fingerprint.value == topology.fingerprint:
+                metrics.count("SubnetsScanned", fingerprint.value[0])
+                metrics.count("CacheHit")
+                return topology
+
+        findr = CidrFindr(networks=vpc_cidrs)
+        findr.add_subnets(subnet_cidrs)
+
+    metrics.count("SubnetsScanned", fingerprint.value[0])
+    metrics.count("CacheHit", 0)
+
+    return _store_topology(vpc_id, vpc_cidrs, findr, fingerprint, topology, cache)
+
+def _store_topology(vpc_id, vpc_cidrs, findr, fingerprint, previous, cache):
+    """
+    Wrap freshly discovered state in a Topology, carrying over the previous one's allocations
+    """
+
+    allocations = previous.allocations if previous is not None else []
+
+    # Blocks handed out recently may not have been created yet
+    findr.add_subnets(allocations)
+
+    topology = Topology(vpc_cidrs, findr, fingerprint.value)
+    topology.record(allocations)
+
+    if cache is not None:
+        cache.put(vpc_id, topology)
+
+    return topology
+
+def load_topologies(client, vpc_ids, cache=None):
+    """
+    Return {VpcId: Topology} for many VPCs from one listing of all their VPCs and subnets,
+    reusing cached topologies that haven't changed. VPCs that don't exist are left out.
+    """
+
+    vpc_cidrs = get_executor().submit(describe_vpcs_cidrs, client, vpc_ids)
+    subnet_cidrs = group_subnet_cidrs(client, vpc_ids)
+    vpc_cidrs = vpc_cidrs.result()
+
+    topologies = {}
+
+    for vpc_id, cidrs in vpc_cidrs.items():
+        topology = cache.get(vpc_id) if cache is not None else None
+        fingerprint = Fingerprint()
+
+        subnets = list(fingerprint.track(subnet_cidrs.get(vpc_id, [])))
+
+        if topology is None or topology.vpc_cidrs != cidrs or topology.fingerprint != fingerprint.value:
+            topology = _store_topology(vpc_id, cidrs, CidrFindr(networks=cidrs, subnets=subnets), fingerprint, topology, cache)
+
+        topologies[vpc_id] = topology
+
+    return topologies
+
+def allocate(findr, sizes, ipv6_sizes):
     """
-    Handle a CloudFormation custom resource event
+    Allocate the IPv4 and IPv6 blocks together: if either doesn't fit, neither is allocated
     """
 
+    result = findr.next_subnets(sizes)
+
+    try:
+        ipv6_result = findr.next_subnets(ipv6_sizes, version=6)
+    except CidrFindrException:
+        for cidr_block in result:
+            findr.release(cidr_block)
+
+        raise
+
+    return result, ipv6_result
+
+def allocate_reserved(topology, vpc_id, sizes, ipv6_sizes, reservations, owner, attempts=RESERVE_ATTEMPTS):
+    """
+    Allocate around the blocks other requests have reserved and reserve the
+    result, starting over if another request reserved blocks in the meantime
+    """
+
+    for _ in range(attempts):
+        try:
+            version, reserved = reservations.reserved(vpc_id)
+        except Exception as e:
+            raise CidrFindrException("Couldn't read the reservation ledger: {}".format(e))
+
+        new = [cidr for cidr in reserved if cidr not in topology.reserved]
+
+        topology.findr.add_subnets(new)
+        topology.reserved.update(new)
+
+        result, ipv6_result = allocate(topology.findr, sizes, ipv6_sizes)
+
+        try:
+            reserved = reservations.reserve(vpc_id, result + ipv6_result, owner, version)
+            error = None
+        except Exception as e:
+            reserved = False
+            error = e
+
+        if reserved:
+            # Our own reservations are already in findr
+            topology.reserved.update(result + ipv6_result)
+
+            return result, ipv6_result
+
+        for cidr_block in result + ipv6_result:
+            topology.findr.release(cidr_block)
+
+        if error is not None:
+            raise CidrFindrException("Couldn't write to the reservation ledger: {}".format(error))
+
+    raise CidrFindrException("Couldn't reserve CIDR blocks in {} after {} attempts".format(vpc_id, attempts))
+
+def free_space(findr):
+    """
+    Describe the space left in a VPC as response attributes
+    """
+
+    data = {}
+
+    for version, prefix in ((4, ""), (6, "Ipv6")):
+        if not any(network.network.version == version for network in findr.networks):
+            continue
+
+        largest = findr.largest_free_prefix(version)
+
+        data[prefix + "FreeAddresses"] = str(findr.free_addresses(version))
+        data[prefix + "LargestFreePrefix"] = str(largest) if largest is not None else ""
+        data[prefix + "Fragmentation"] = "{:.4f}".format(findr.fragmentation(version))
+
+    return data
+
+@profiled("handler")
+def handler(event, context, responder=send_response, client=None, cache=topology_cache, metrics=None, reservations=None):
+    """
+    Handle a CloudFormation custom resource event.
+    Phase timings are logged as CloudWatch metrics when CIDR_FINDR_METRICS is set,
+    and the invocation is profiled when CIDR_FINDR_PROFILE is.
+    """
+
+    if metrics is None:
+        metrics = new_metrics()
+
+    if not metrics.enabled:
+        return _handle(event, context, responder, client, cache, metrics, reservations)
+
+    def timed_responder(*args, **kwargs):
+        with metrics.span("SendResponse"):
+            outcome = responder(*args, **kwargs)
+
+        if outcome is not None and hasattr(outcome, "attempts"):
+            metrics.count("ResponseAttempts", outcome.attempts)
+
+        return outcome
+
+    metrics.set_property("RequestType", event.get("RequestType"))
+
+    try:
+        with metrics.span("Total"):
+            return _handle(event, context, timed_responder, client, cache, metrics, reservations)
+    finally:
+        metrics.emit()
+
+def physical_resource_id(vpc_id, cidr_blocks, ipv6_cidr_blocks):
+    """
+    Encode an allocation as the resource's physical id so that an Update can find it again.
+    The sizes are in the old properties, so only the bases are kept, in hex: 8 digits for
+    IPv4 and the top 16 for IPv6, whose blocks are /64 or larger. An id that is still too
+    long for CloudFormation is cut down to the VpcId, and an Update then allocates afresh.
+    """
+
+    resource_id = "{}|{}|{}".format(
+        vpc_id,
+        ",".join("{:08x}".format(parse_cidr(cidr_block)[0]) for cidr_block in cidr_blocks),
+        ",".join("{:016x}".format(parse_cidr(cidr_block)[0] >> 64) for cidr_block in ipv6_cidr_blocks),
+    )
+
+    if len(resource_id) > MAX_PHYSICAL_ID_LENGTH:
+        return vpc_id
+
+    return resource_id
+
+def _decode_blocks(bases, sizes, bits):
+    """
+    Turn the hex bases from a physical id back into CIDR blocks of the given sizes
+    """
+
+    shift = 64 if bits == 128 else 0
+    cidr_blocks = []
+
+    for base, size in zip(bases, sizes):
+        cidr_block = "{}/{}".format(format_ip(int(base, 16) << shift, bits), size)
+
+        # Rejects a base with host bits set for its size
+        parse_cidr(cidr_block)
+
+        cidr_blocks.append(cidr_block)
+
+    return cidr_blocks
+
+def previous_allocation(event, vpc_id):
+    """
+    Return the (sizes, CIDR blocks, IPv6 sizes, IPv6 CIDR blocks) that an Update
+    event is changing, or None when there is nothing in the same VPC to reuse
+    """
+
+    if event["RequestType"] != "Update":
+        return None
+
+    old_properties = event.get("OldResourceProperties", {})
+    parts = event.get("PhysicalResourceId", "").split("|")
+
+    if len(parts) != 3 or parts[0] != vpc_id or old_properties.get("VpcId") != vpc_id:
+        return None
+
+    bases = [base for base in parts[1].split(",") if base]
+    ipv6_bases = [base for base in parts[2].split(",") if base]
+
+    sizes = tuple(map(parse_size, old_properties.get("Sizes", [])))
+    ipv6_sizes = tuple(map(parse_size, old_properties.get("Ipv6Sizes", [])))
+
+    if len(sizes) != len(bases) or len(ipv6_sizes) != len(ipv6_bases):
+        return None
+
+    try:
+        cidr_blocks = _decode_blocks(bases, sizes, 32)
+        ipv6_cidr_blocks = _decode_blocks(ipv6_bases, ipv6_sizes, 128)
+    except (CidrFindrException, OverflowError, ValueError):
+        return None
+
+    return sizes, cidr_blocks, ipv6_sizes, ipv6_cidr_blocks
+
+def reuse(old_sizes, old_cidr_blocks, sizes):
+    """
+    Keep the old block at each position whose size hasn't changed, leaving None where one is needed
+    """
+
+    return [
+        old_cidr_blocks[i] if i < len(old_sizes) and old_sizes[i] == size else None
+        for i, size in enumerate(sizes)
+    ]
+
+def _handle(event, context, responder, client, cache, metrics, reservations):
     # Always return success on Delete events
     if event["RequestType"] == "Delete":
         return responder(event, context, "SUCCESS")
 
+    # CloudFormation resends a request when it doesn't hear back; answer it the same way
+    request_key = (event.get("RequestId"), event.get("LogicalResourceId"))
+    answered = response_cache.get(request_key) if "RequestId" in event else None
+
+    if answered is not None:
+        resource_id, response_data = answered
+        return responder(event, context, "SUCCESS", response_data=response_data, physical_resource_id=resource_id)
+
     properties = event.get("ResourceProperties", {})
 
     missing = [param for param in ("VpcId", "Sizes") if param not in properties]
@@ -34,35 +368,171 @@ def handler(event, context, responder=send_response, client=ec2):
     # Collect parameters
     vpc_id = properties["VpcId"]
     sizes = properties["Sizes"]
+    ipv6_sizes = properties.get("Ipv6Sizes", [])
 
     parsed_sizes = tuple(map(parse_size, sizes))
+    parsed_ipv6_sizes = tuple(map(parse_size, ipv6_sizes))
 
     # Check the sizes are valid
     if not sizes_valid(parsed_sizes):
-        return responder(event, context, "FAILED", reason="An invalid subnet size was specified: {}".format(", ".join(sizes)))
+        return responder(event, context, "FAILED", reason="An invalid subnet size was specified: {}".format(", ".join(map(str, sizes))))
 
-    # Query existing subnets
-    try:
-        vpc_cidrs = [
-            cidr_block_association["CidrBlock"]
-            for cidr_block_association
-            in client.describe_vpcs(VpcIds=[vpc_id])["Vpcs"][0]["CidrBlockAssociationSet"]
-        ]
-    except Exception as e:
-        return responder(event, context, "FAILED", reason=str(e))
+    if not ipv6_sizes_valid(parsed_ipv6_sizes):
+        return responder(event, context, "FAILED", reason="An invalid IPv6 subnet size was specified: {}".format(", ".join(map(str, ipv6_sizes))))
 
-    subnet_cidrs = [subnet["CidrBlock"] for subnet in client.describe_subnets(Filters=[{"Name": "vpc-id", "Values": [vpc_id]}])["Subnets"]]
+    metrics.set_property("VpcId", vpc_id)
 
-    findr = CidrFindr(networks=vpc_cidrs, subnets=subnet_cidrs)
+    result = [None] * len(parsed_sizes)
+    ipv6_result = [None] * len(parsed_ipv6_sizes)
+    old_cidr_blocks = []
 
-    # These are the CIDRs you're looking for
-    try:
-        result = [findr.next_subnet(size) for size in parsed_sizes]
-    except CidrFindrException as e:
-        return responder(event, context, "FAILED", reason=str(e))
+    # On Update, blocks whose size hasn't changed stay where they are
+    prior = previous_allocation(event, vpc_id)
 
-    # We have a winner
-    return responder(event, context, "SUCCESS", response_data={
+    if prior is not None:
+        old_sizes, old_blocks, old_ipv6_sizes, old_ipv6_blocks = prior
+
+        result = reuse(old_sizes, old_blocks, parsed_sizes)
+        ipv6_result = reuse(old_ipv6_sizes, old_ipv6_blocks, parsed_ipv6_sizes)
+        old_cidr_blocks = old_blocks + old_ipv6_blocks
+
+    wanted = [size for size, cidr_block in zip(parsed_sizes, result) if cidr_block is None]
+    ipv6_wanted = [size for size, cidr_block in zip(parsed_ipv6_sizes, ipv6_result) if cidr_block is None]
+
+    report_free_space = str(properties.get("ReportFreeSpace", "")).lower() == "true"
+
+    topology = None
+
+    # Nothing new to allocate means no need to look at the VPC at all
+    if wanted or ipv6_wanted or report_free_space:
+        if client is None:
+            with metrics.span("CreateClient"):
+                client = get_ec2_client()
+
+        # Query existing subnets
+        try:
+            with metrics.span("Discovery"):
+                topology = load_topology(client, vpc_id, cache, metrics)
+        except Exception as e:
+            return responder(event, context, "FAILED", reason=str(e))
+
+        # Old blocks, kept or not, may not exist yet and must not be handed out again
+        unseen = [cidr_block for cidr_block in old_cidr_blocks if cidr_block not in topology.reserved]
+
+        topology.findr.add_subnets(unseen)
+        topology.reserved.update(unseen)
+
+        searches = topology.findr.searches
+
+        # These are the CIDRs you're looking for
+        try:
+            # The ledger is only opened when there is something to allocate
+            if reservations is None:
+                try:
+                    reservations = get_reservations()
+                except Exception as e:
+                    raise CidrFindrException("Couldn't open the reservation ledger: {}".format(e))
+
+            with metrics.span("Allocate"):
+                if reservations is None:
+                    allocated, ipv6_allocated = allocate(topology.findr, wanted, ipv6_wanted)
+                else:
+                    owner = "{}|{}".format(event.get("StackId", ""), event.get("LogicalResourceId", event.get("RequestId", "")))
+                    allocated, ipv6_allocated = allocate_reserved(topology, vpc_id, wanted, ipv6_wanted, reservations, owner)
+        except CidrFindrException as e:
+            return responder(event, context, "FAILED", reason=str(e))
+        finally:
+            metrics.count("NetworksSearched", topology.findr.searches - searches)
+
+        topology.record(allocated + ipv6_allocated)
+
+        # Fill the gaps left by reuse, in order
+        allocated = iter(allocated)
+        ipv6_allocated = iter(ipv6_allocated)
+
+        result = [cidr_block or next(allocated) for cidr_block in result]
+        ipv6_result = [cidr_block or next(ipv6_allocated) for cidr_block in ipv6_result]
+
+    response_data = {
         "CidrBlock{}".format(i + 1): cidr_block
         for i, cidr_block in enumerate(result)
+    }
+
+    response_data.update({
+        "Ipv6CidrBlock{}".format(i + 1): cidr_block
+        for i, cidr_block in enumerate(ipv6_result)
     })
+
+    if report_free_space:
+        response_data.update(free_space(topology.findr))
+
+    resource_id = physical_resource_id(vpc_id, result, ipv6_result)
+
+    if "RequestId" in event:
+        response_cache.put(request_key, (resource_id, response_data))
+
+    # We have a winner
+    return responder(event, context, "SUCCESS", response_data=response_data, physical_resource_id=resource_id)
+
+def batch_handler(event, context, client=None, cache=topology_cache):
+    """
+    Allocate blocks for many requests in many VPCs in one invocation, e.g. for bulk
+    provisioning. All the VPCs are discovered together with a couple of API calls.
+
+    The event is {"Requests": [{"VpcId": ..., "Sizes": [...], "Ipv6Sizes": [...]}, ...]}
+    and the result is {"Results": [...]} in the same order, each holding the VpcId
+    with either CidrBlocks and Ipv6CidrBlocks or an Error. Requests for the same
+    VPC are allocated one after another, so they never overlap.
+    """
+
+    requests = event.get("Requests", [])
+    results = [{"VpcId": request.get("VpcId")} for request in requests]
+    wanted = []
+
+    for request, result in zip(requests, results):
+        missing = [param for param in ("VpcId", "Sizes") if param not in request]
+
+        if missing:
+            result["Error"] = "Missing parameter(s): {}".format(", ".join(missing))
+            continue
+
+        sizes = tuple(map(parse_size, request["Sizes"]))
+        ipv6_sizes = tuple(map(parse_size, request.get("Ipv6Sizes", [])))
+
+        if not sizes_valid(sizes):
+            result["Error"] = "An invalid subnet size was specified: {}".format(", ".join(map(str, request["Sizes"])))
+        elif not ipv6_sizes_valid(ipv6_sizes):
+            result["Error"] = "An invalid IPv6 subnet size was specified: {}".format(", ".join(map(str, request["Ipv6Sizes"])))
+        else:
+            wanted.append((result, sizes, ipv6_sizes))
+
+    vpc_ids = sorted({result["VpcId"] for result, _, _ in wanted})
+
+    if vpc_ids:
+        if client is None:
+            client = get_ec2_client()
+
+        try:
+            topologies = load_topologies(client, vpc_ids, cache)
+        except Exception as e:
+            for result, _, _ in wanted:
+                result["Error"] = str(e)
+
+            return {"Results": results}
+
+        for result, sizes, ipv6_sizes in wanted:
+            topology = topologies.get(result["VpcId"])
+
+            if topology is None:
+                result["Error"] = "VPC not found: {}".format(result["VpcId"])
+                continue
+
+            try:
+                result["CidrBlocks"], result["Ipv6CidrBlocks"] = allocate(topology.findr, sizes, ipv6_sizes)
+            except CidrFindrException as e:
+                result["Error"] = str(e)
+                continue
+
+            topology.record(result["CidrBlocks"] + result["Ipv6CidrBlocks"])
+
+    return {"Results": results}
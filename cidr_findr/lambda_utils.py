@@ -8,9 +8,9 @@ http://aws.amazon.com/apache2.0/
 or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
 """
 
-from urllib.parse import urlencode
-from urllib.request import urlopen, Request, HTTPError, URLError
+from urllib.parse import urlsplit
 import json
+import time
 
 def parse_size(size):
     """
@@ -30,10 +30,142 @@ def sizes_valid(sizes):
     """
     return all(isinstance(size, int) and size >= 16 and size <= 28 for size in sizes)
 
-def send_response(event, context, response_status, reason=None, response_data={}):
+def ipv6_sizes_valid(sizes):
+    """
+    Validate the IPv6 subnet masks: /44 to /64 in steps of 4
+    """
+    return all(isinstance(size, int) and size >= 44 and size <= 64 and size % 4 == 0 for size in sizes)
+
+class ResponseOutcome(object):
+    """
+    The result of sending a response: whether it was delivered, the last HTTP
+    status or error, how many attempts were made and how long it all took
+    """
+
+    __slots__ = ("ok", "status", "error", "attempts", "latency")
+
+    def __init__(self, ok, status=None, error=None, attempts=0, latency=0.0):
+        self.ok = ok
+        self.status = status
+        self.error = error
+        self.attempts = attempts
+        self.latency = latency
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return "ResponseOutcome(ok={}, status={}, error={!r}, attempts={}, latency={:.3f})".format(
+            self.ok, self.status, self.error, self.attempts, self.latency,
+        )
+
+class ResponseSender(object):
+    """
+    PUTs responses to pre-signed URLs with connect and read timeouts, retrying
+    server errors with exponential backoff, and keeping connections open so
+    that warm invocations can reuse them
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=10, attempts=4, backoff=0.5, sleep=time.sleep):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.sleep = sleep
+
+        self._connections = {}
+
+    def _connect(self, scheme, netloc):
+        # http.client pulls in ssl and email, so only import it when sending
+        from http.client import HTTPConnection, HTTPSConnection
+
+        connection_class = HTTPSConnection if scheme == "https" else HTTPConnection
+
+        connection = connection_class(netloc, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+
+        return connection
+
+    def _close(self, key):
+        connection = self._connections.pop(key, None)
+
+        if connection is not None:
+            connection.close()
+
+    def put(self, url, body):
+        from http.client import HTTPException
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = "{}?{}".format(parts.path or "/", parts.query) if parts.query else parts.path or "/"
+
+        start = time.monotonic()
+        status = None
+        error = None
+        attempt = 0
+
+        while attempt < self.attempts:
+            attempt += 1
+            reused = key in self._connections
+
+            try:
+                if not reused:
+                    self._connections[key] = self._connect(*key)
+
+                connection = self._connections[key]
+                connection.request("PUT", path, body=body, headers={
+                    "Content-Length": str(len(body)),
+                    "Content-Type": "",
+                })
+
+                response = connection.getresponse()
+                response.read()
+
+                status = response.status
+                error = None
+
+                if response.will_close:
+                    self._close(key)
+
+                if status < 300:
+                    return ResponseOutcome(True, status, None, attempt, time.monotonic() - start)
+
+                error = "HTTP {}".format(status)
+
+                # Only server errors and throttling are worth another go
+                if status < 500 and status != 429:
+                    break
+            except (OSError, HTTPException) as e:
+                self._close(key)
+
+                status = None
+                error = str(e) or type(e).__name__
+
+                # A kept-alive connection may have been closed while the container was frozen
+                if reused:
+                    attempt -= 1
+                    continue
+
+            if attempt < self.attempts:
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+
+        return ResponseOutcome(False, status, error, attempt, time.monotonic() - start)
+
+response_sender = ResponseSender()
+
+def send_response(event, context, response_status, reason=None, response_data={}, sender=None, physical_resource_id=None):
+    """
+    Send the result of a custom resource request back to CloudFormation.
+    Unless told otherwise, the resource keeps the physical id it already has.
+    """
+
+    if physical_resource_id is None:
+        physical_resource_id = event.get("PhysicalResourceId") or context.log_stream_name
+
     body = {
         "Status": response_status,
-        "PhysicalResourceId": context.log_stream_name,
+        "PhysicalResourceId": physical_resource_id,
         "StackId": event["StackId"],
         "RequestId": event["RequestId"],
         "LogicalResourceId": event["LogicalResourceId"],
@@ -51,18 +183,12 @@ def send_response(event, context, response_status, reason=None, response_data={}
 
     body = json.dumps(body).encode("utf-8")
 
-    req = Request(event["ResponseURL"], data=body, headers={
-        "Content-Length": len(body),
-        "Content-Type": "",
-    })
-    req.get_method = lambda: "PUT"
-
-    try:
-        urlopen(req)
-        return True
-    except HTTPError as e:
-        print("Failed executing HTTP request: {}".format(e.code))
-        return False
-    except URLError as e:
-        print("Failed to reach the server: {}".format(e.reason))
-        return False
+    outcome = (sender or response_sender).put(event["ResponseURL"], body)
+
+    if not outcome.ok:
+        if outcome.status is not None:
+            print("Failed executing HTTP request: {}".format(outcome.status))
+        else:
+            print("Failed to reach the server: {}".format(outcome.error))
+
+    return outcome
@@ -0,0 +1,156 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+import json
+import os
+import time
+
+NAMESPACE = "CidrFindr"
+
+class _Span(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.metrics.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.name, self.metrics.clock() - self.start)
+
+class Metrics(object):
+    """
+    Collects timings and counts for one invocation and emits them as a single
+    CloudWatch Embedded Metric Format log line. Timings are in milliseconds.
+    """
+
+    enabled = True
+
+    def __init__(self, namespace=NAMESPACE, sink=print, clock=time.perf_counter):
+        self.namespace = namespace
+        self.sink = sink
+        self.clock = clock
+
+        self.timings = {}
+        self.counts = {}
+        self.properties = {}
+
+    def span(self, name):
+        """
+        A context manager adding the time spent inside it to the named timing
+        """
+
+        return _Span(self, name)
+
+    def timed(self, name, iterable):
+        """
+        Yield from iterable, adding the time spent fetching each item to the named timing
+        """
+
+        iterator = iter(iterable)
+
+        while True:
+            start = self.clock()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, self.clock() - start)
+
+            yield item
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds * 1000
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def document(self):
+        """
+        The metrics as an Embedded Metric Format document
+        """
+
+        document = dict(self.properties)
+
+        definitions = [{"Name": name, "Unit": "Milliseconds"} for name in sorted(self.timings)]
+        definitions += [{"Name": name, "Unit": "Count"} for name in sorted(self.counts)]
+
+        document.update(self.timings)
+        document.update(self.counts)
+
+        document["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": self.namespace,
+                "Dimensions": [[]],
+                "Metrics": definitions,
+            }],
+        }
+
+        return document
+
+    def emit(self):
+        self.sink(json.dumps(self.document(), sort_keys=True))
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class NullMetrics(object):
+    """
+    Stands in for Metrics when they are turned off, doing as little as possible
+    """
+
+    enabled = False
+
+    _span = _NullSpan()
+
+    def span(self, name):
+        return self._span
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def set_property(self, name, value):
+        pass
+
+    def emit(self):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+def new_metrics():
+    """
+    Metrics for a new invocation, or NULL_METRICS unless CIDR_FINDR_METRICS is set
+    """
+
+    if os.environ.get("CIDR_FINDR_METRICS", "").lower() in ("1", "true", "yes", "on"):
+        return Metrics()
+
+    return NULL_METRICS
@@ -0,0 +1,134 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+
+On-demand profiling, configured by environment variables read at import time:
+
+    CIDR_FINDR_PROFILE          set to 1 to profile
+    CIDR_FINDR_PROFILE_SAMPLE   profile 1 in this many calls (default 1, every call)
+    CIDR_FINDR_PROFILE_DIR      where to write the results (default /tmp)
+    CIDR_FINDR_PROFILE_TOP      how many functions and allocations to log (default 10)
+
+When profiling is off, profiled() hands back the function it decorates untouched.
+"""
+
+import os
+import time
+
+def _enabled():
+    return os.environ.get("CIDR_FINDR_PROFILE", "").lower() in ("1", "true", "yes", "on")
+
+# Set while a profile is being taken, so that profiled calls inside it don't start another
+_active = False
+
+def profiled(name, enabled=None, sample=None, directory=None, top=None, log=print):
+    """
+    Decorate a function so that its calls are profiled with cProfile and
+    tracemalloc. The stats are written to the directory and a summary of the
+    top functions and allocations is logged.
+    """
+
+    if enabled is None:
+        enabled = _enabled()
+
+    if not enabled:
+        return lambda func: func
+
+    sample = sample or int(os.environ.get("CIDR_FINDR_PROFILE_SAMPLE") or 1)
+    directory = directory or os.environ.get("CIDR_FINDR_PROFILE_DIR") or "/tmp"
+    top = top or int(os.environ.get("CIDR_FINDR_PROFILE_TOP") or 10)
+
+    def decorate(func):
+        from functools import wraps
+        import random
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            global _active
+
+            if _active or random.random() * sample >= 1:
+                return func(*args, **kwargs)
+
+            import cProfile
+            import tracemalloc
+
+            _active = True
+
+            profile = cProfile.Profile()
+            tracing = not tracemalloc.is_tracing()
+
+            if tracing:
+                tracemalloc.start()
+
+            try:
+                profile.enable()
+
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    profile.disable()
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+
+                if tracing:
+                    tracemalloc.stop()
+
+                _active = False
+
+                # Profiling must never break the call it wraps
+                try:
+                    report(name, profile, snapshot, directory, top, log)
+                except Exception as e:
+                    log("Couldn't write the profile of {}: {}".format(name, e))
+
+        return wrapper
+
+    return decorate
+
+def report(name, profile, snapshot, directory, top, log=print):
+    """
+    Write the profile and the allocations to files and log the top entries of each.
+    Return the two paths.
+    """
+
+    import pstats
+    import tracemalloc
+
+    prefix = os.path.join(directory, "cidr-findr-{}-{}-{}".format(name, int(time.time() * 1000), os.getpid()))
+
+    profile_path = prefix + ".prof"
+    memory_path = prefix + ".mem.txt"
+
+    profile.dump_stats(profile_path)
+
+    stats = pstats.Stats(profile).stats
+    functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+
+    allocations = snapshot.filter_traces([
+        # Leave out tracemalloc's own bookkeeping
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ]).statistics("lineno")
+
+    with open(memory_path, "w") as f:
+        for statistic in allocations:
+            f.write("{}\n".format(statistic))
+
+    lines = ["Profile of {} written to {}".format(name, profile_path)]
+
+    for (filename, line, function), (_, calls, _, cumulative, _) in functions[:top]:
+        lines.append("  {:>10.6f}s {:>8} {}:{}({})".format(cumulative, calls, os.path.basename(filename), line, function))
+
+    lines.append("Allocations written to {}".format(memory_path))
+
+    for statistic in allocations[:top]:
+        frame = statistic.traceback[0]
+        lines.append("  {:>10} B {:>8} {}:{}".format(statistic.size, statistic.count, os.path.basename(frame.filename), frame.lineno))
+
+    log("\n".join(lines))
+
+    return profile_path, memory_path
@@ -0,0 +1,126 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+import threading
+import time
+
+class ReservationBackend(object):
+    """
+    Somewhere to record the blocks handed out to stacks that have yet to create
+    their subnets, so that concurrent requests for one VPC don't collide.
+
+    Every VPC has a version that changes whenever its reservations do; a write
+    only succeeds if the version is still the one its caller read. A DynamoDB
+    table can do the same with a conditional write on a version attribute.
+    """
+
+    def reserved(self, vpc_id):
+        """
+        Return the VPC's version and the CIDR blocks reserved in it that haven't expired
+        """
+
+        raise NotImplementedError()
+
+    def reserve(self, vpc_id, cidrs, owner, version):
+        """
+        Reserve the CIDR blocks for owner unless the VPC's version has moved on
+        from version, returning whether they were reserved
+        """
+
+        raise NotImplementedError()
+
+    def release(self, vpc_id, cidrs):
+        """
+        Drop reservations before they expire
+        """
+
+        raise NotImplementedError()
+
+class SqliteReservations(ReservationBackend):
+    """
+    Reservations kept in a SQLite database, shared by every process that opens the same file
+    """
+
+    def __init__(self, path, ttl=600, clock=time.time):
+        import sqlite3
+
+        self.ttl = ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+
+        with self._lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS versions (vpc_id TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS reservations (vpc_id TEXT, cidr TEXT, owner TEXT, expires REAL, PRIMARY KEY (vpc_id, cidr))")
+
+    def _version(self, vpc_id):
+        row = self._db.execute("SELECT version FROM versions WHERE vpc_id = ?", (vpc_id,)).fetchone()
+
+        return row[0] if row else 0
+
+    def reserved(self, vpc_id):
+        with self._lock:
+            self._db.execute("BEGIN")
+
+            try:
+                version = self._version(vpc_id)
+                rows = self._db.execute("SELECT cidr FROM reservations WHERE vpc_id = ? AND expires > ?", (vpc_id, self.clock())).fetchall()
+            finally:
+                self._db.execute("COMMIT")
+
+        return version, [cidr for cidr, in rows]
+
+    def _write(self, vpc_id, version, statements):
+        """
+        Run statements and bump the VPC's version if it is still version
+        """
+
+        with self._lock:
+            # Take the write lock up front so that the check and the write are atomic
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                if version is not None and self._version(vpc_id) != version:
+                    self._db.execute("ROLLBACK")
+                    return False
+
+                for statement, params in statements:
+                    self._db.execute(statement, params)
+
+                self._db.execute("INSERT OR IGNORE INTO versions VALUES (?, 0)", (vpc_id,))
+                self._db.execute("UPDATE versions SET version = version + 1 WHERE vpc_id = ?", (vpc_id,))
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._db.execute("COMMIT")
+
+        return True
+
+    def reserve(self, vpc_id, cidrs, owner, version):
+        now = self.clock()
+
+        statements = [("DELETE FROM reservations WHERE vpc_id = ? AND expires <= ?", (vpc_id, now))]
+        statements += [
+            ("INSERT OR REPLACE INTO reservations VALUES (?, ?, ?, ?)", (vpc_id, cidr, owner, now + self.ttl))
+            for cidr in cidrs
+        ]
+
+        return self._write(vpc_id, version, statements)
+
+    def release(self, vpc_id, cidrs):
+        self._write(vpc_id, None, [
+            ("DELETE FROM reservations WHERE vpc_id = ? AND cidr = ?", (vpc_id, cidr))
+            for cidr in cidrs
+        ])
+
+    def close(self):
+        self._db.close()
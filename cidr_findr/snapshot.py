@@ -0,0 +1,214 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from .buddy import BuddyNetwork
+from .compact import ArrayNetwork
+from .cidr_findr import CidrFindr, CidrFindrException, Network, Range
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+# Layout, all little-endian:
+#
+#   header:  magic, format version, network class code, network count, padded to 16 bytes
+#   network: address bits, prefix, class code, subnet count, base (high and low 64 bits)
+#            followed by the subnet bases (uint32 for IPv4, high then low uint64 arrays
+#            for IPv6) and one byte of prefix per subnet, the whole record padded to 8 bytes
+MAGIC = b"CIDR"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHI4x")
+NETWORK = struct.Struct("<BBBxIQQ")
+
+# Files at least this large are memory-mapped rather than read
+MMAP_THRESHOLD = 1 << 20
+
+MASK_64 = (1 << 64) - 1
+
+AUTO = 0
+
+def _network_classes():
+    classes = {1: Network, 2: BuddyNetwork, 4: ArrayNetwork}
+
+    try:
+        from .bitmap import BitmapNetwork
+    except ImportError:
+        pass
+    else:
+        classes[3] = BitmapNetwork
+
+    return classes
+
+def _class_code(cls):
+    if cls is None:
+        return AUTO
+
+    # Only exact matches: a subclass may hold state the snapshot can't carry
+    for code, known in _network_classes().items():
+        if cls is known:
+            return code
+
+    raise CidrFindrException("Can't snapshot a {} network".format(cls.__name__))
+
+def _padding(length):
+    return -length % 8
+
+def _column(view, typecode):
+    """
+    Read little-endian integers from a buffer into an array with a single copy
+    """
+
+    values = array(typecode)
+    values.frombytes(view)
+
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    return values
+
+def _pack(typecode, values):
+    values = array(typecode, values)
+
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    return values.tobytes()
+
+def dumps(findr):
+    """
+    Return the state of a CidrFindr, including any blocks it has handed out, as bytes
+    """
+
+    chunks = [HEADER.pack(MAGIC, VERSION, _class_code(findr.network_class), len(findr.networks))]
+
+    for network in findr.networks:
+        cidr = network.network
+        # The order ArrayNetwork keeps its columns in, so that it can load them as they are
+        subnets = sorted(network.subnets, key=lambda subnet: (subnet.base, subnet.size))
+
+        chunks.append(NETWORK.pack(
+            cidr.bits,
+            cidr.size,
+            _class_code(type(network)),
+            len(subnets),
+            cidr.base >> 64,
+            cidr.base & MASK_64,
+        ))
+
+        if cidr.bits == 32:
+            chunks.append(_pack("I", (subnet.base for subnet in subnets)))
+        else:
+            chunks.append(_pack("Q", (subnet.base >> 64 for subnet in subnets)))
+            chunks.append(_pack("Q", (subnet.base & MASK_64 for subnet in subnets)))
+
+        chunks.append(bytes(subnet.size for subnet in subnets))
+        chunks.append(bytes(_padding(cidr.bits // 8 * len(subnets) + len(subnets))))
+
+    return b"".join(chunks)
+
+def loads(data):
+    """
+    Rebuild a CidrFindr from the output of dumps
+    """
+
+    view = memoryview(data)
+
+    try:
+        return _load(view)
+    finally:
+        view.release()
+
+def _load(view):
+    if len(view) < HEADER.size:
+        raise CidrFindrException("Not a CIDR finder snapshot")
+
+    magic, version, class_code, count = HEADER.unpack_from(view)
+
+    if magic != MAGIC:
+        raise CidrFindrException("Not a CIDR finder snapshot")
+
+    if version != VERSION:
+        raise CidrFindrException("Unsupported snapshot version {}".format(version))
+
+    classes = _network_classes()
+
+    findr = CidrFindr(network_class=classes.get(class_code))
+    offset = HEADER.size
+
+    try:
+        for _ in range(count):
+            bits, size, code, length, high, low = NETWORK.unpack_from(view, offset)
+            offset += NETWORK.size
+
+            network = Range(base=high << 64 | low, size=size, bits=bits)
+            start = offset
+
+            if bits == 32:
+                bases = _column(view[offset:offset + 4 * length], "I")
+                offset += 4 * length
+            else:
+                highs = _column(view[offset:offset + 8 * length], "Q")
+                offset += 8 * length
+                lows = _column(view[offset:offset + 8 * length], "Q")
+                offset += 8 * length
+
+                bases = [high << 64 | low for high, low in zip(highs, lows)]
+
+            sizes = _column(view[offset:offset + length], "B")
+            offset += length
+
+            offset += _padding(offset - start)
+
+            if len(bases) != length or len(sizes) != length:
+                raise CidrFindrException("Truncated snapshot")
+
+            # A snapshot taken with NumPy installed still loads without it
+            cls = classes.get(code, Network)
+
+            if cls is ArrayNetwork and bits == 32:
+                # The columns are already in order, so no Range is made for them
+                findr.networks.append(ArrayNetwork.from_columns(network, bases, sizes))
+            else:
+                subnets = [Range(base=base, size=size, bits=bits) for base, size in zip(bases, sizes)]
+
+                findr.networks.append(cls(network, subnets))
+    except (struct.error, TypeError, ValueError):
+        raise CidrFindrException("Truncated snapshot")
+
+    return findr
+
+def dump(findr, path):
+    """
+    Write a snapshot of a CidrFindr to a file
+    """
+
+    data = dumps(findr)
+
+    # Write alongside and rename so that readers never see half a snapshot
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+
+    with open(temporary, "wb") as f:
+        f.write(data)
+
+    os.replace(temporary, path)
+
+def load(path):
+    """
+    Read a snapshot written by dump, memory-mapping it when it is large
+    """
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            return loads(f.read())
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return loads(mapped)
@@ -0,0 +1,97 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from benchmarks import memory, run
+from benchmarks.topologies import TOPOLOGIES
+from cidr_findr import ArrayNetwork, CidrFindr, Network
+from cidr_findr.cidr_findr import Range
+import json
+import os
+import tempfile
+import unittest
+
+class BenchmarksTestCase(unittest.TestCase):
+    """
+    Test the benchmark suite itself
+    """
+
+    def test_topologies_seeded(self):
+        """
+        Every topology is reproducible from its seed and builds a valid CidrFindr
+        """
+
+        for name, generate in TOPOLOGIES.items():
+            networks, subnets = generate(300, seed=1)
+
+            self.assertEqual(generate(300, seed=1), (networks, subnets), name)
+
+            findr = CidrFindr(networks=networks, subnets=subnets)
+
+            # No subnet overlaps another
+            ranges = sorted((Range(cidr=subnet) for subnet in subnets), key=lambda subnet: subnet.base)
+
+            for before, after in zip(ranges, ranges[1:]):
+                self.assertLessEqual(before.top, after.base, name)
+
+            self.assertTrue(findr.networks, name)
+
+    def test_compare(self):
+        """
+        Only slowdowns beyond the tolerance and the noise floor are regressions
+        """
+
+        baseline = {"a": 1.0, "b": 1.0, "c": 0.00001, "d": 1.0}
+        results = {"a": 1.2, "b": 2.0, "c": 0.00005}
+
+        self.assertEqual(run.compare(results, baseline, 1.5), [("b", 1.0, 2.0, 2.0)])
+
+    def test_main(self):
+        """
+        Results are written out and compared against a baseline
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            args = ["--topologies", "empty,packed", "--scales", "10", "--repeat", "1"]
+
+            self.assertEqual(run.main(args + ["--output", output]), 0)
+
+            with open(output) as f:
+                results = json.load(f)["results"]
+
+            self.assertEqual(sorted(results), [
+                "empty/10/init", "empty/10/next_subnet", "empty/10/next_subnets",
+                "packed/10/init", "packed/10/next_subnet", "packed/10/next_subnets",
+            ])
+
+            for key in results:
+                results[key] = 1e-9
+
+            with open(output, "w") as f:
+                json.dump({"results": results}, f)
+
+            self.assertEqual(run.main(args + ["--baseline", output, "--noise", "0"]), 1)
+
+    def test_memory(self):
+        """
+        The array-backed network holds a small fraction of the memory of the list-backed one
+        """
+
+        networks, subnets = TOPOLOGIES["packed"](20000)
+
+        plain = memory.measure(Network, networks, subnets)
+        compact = memory.measure(ArrayNetwork, networks, subnets)
+
+        self.assertLess(compact["retained"], plain["retained"] * 0.2)
+        self.assertLess(compact["retained"] / len(subnets), 40)
+
+        # Building it never holds a Range for every subnet either
+        self.assertLess(compact["peak"], plain["peak"] * 0.2)
+        self.assertLess(compact["peak"] / len(subnets), 100)
@@ -0,0 +1,128 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr import CidrFindr, CidrFindrException, Network
+from cidr_findr.cidr_findr import Range, select_network_class
+from unittest import mock
+import random
+import sys
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def packed_subnets(count, seed=3):
+    rng = random.Random(seed)
+
+    return list({
+        "10.{}.{}.{}/28".format(rng.randrange(16, 32), rng.randrange(256), rng.randrange(0, 256, 16))
+        for _ in range(count)
+    })
+
+class SelectNetworkClassTestCase(unittest.TestCase):
+    """
+    Test the choice of allocator
+    """
+
+    def test_sparse_network(self):
+        """
+        Small or sparse networks use the default allocator
+        """
+
+        network = Range(cidr="10.16.0.0/12")
+
+        self.assertIs(select_network_class(network, [Range(cidr="10.16.0.0/24")]), Network)
+
+    def test_numpy_missing(self):
+        """
+        Dense networks fall back to the default allocator without NumPy
+        """
+
+        network = Range(cidr="10.16.0.0/12")
+        subnets = [Range(cidr=cidr) for cidr in packed_subnets(2000)]
+
+        with mock.patch.dict(sys.modules, {"numpy": None, "cidr_findr.bitmap": None}):
+            self.assertIs(select_network_class(network, subnets), Network)
+
+@unittest.skipUnless(numpy, "NumPy is not installed")
+class BitmapNetworkTestCase(unittest.TestCase):
+    """
+    Test the NumPy bitmap allocator
+    """
+
+    def test_selected_for_dense_network(self):
+        """
+        Dense networks use the bitmap allocator
+        """
+
+        from cidr_findr.bitmap import BitmapNetwork
+
+        findr = CidrFindr(network="10.16.0.0/12", subnets=packed_subnets(2000))
+
+        self.assertIsInstance(findr.networks[0], BitmapNetwork)
+
+    def test_same_as_first_fit(self):
+        """
+        The bitmap allocator gives the same answers as the default search
+        """
+
+        from cidr_findr.bitmap import BitmapNetwork
+
+        subnets = packed_subnets(2000)
+        requests = [26, 28, 24, 20, 28, 27, 16, 22, 18]
+
+        def allocate(findr):
+            result = []
+
+            for request in requests:
+                try:
+                    result.append(findr.next_subnet(request))
+                except CidrFindrException:
+                    result.append(None)
+
+            return result
+
+        expected = allocate(CidrFindr(network="10.16.0.0/12", subnets=subnets, network_class=Network))
+        actual = allocate(CidrFindr(network="10.16.0.0/12", subnets=subnets, network_class=BitmapNetwork))
+
+        self.assertEqual(actual, expected)
+
+    def test_release(self):
+        """
+        Released space is found again by the bitmap search
+        """
+
+        from cidr_findr.bitmap import BitmapNetwork
+
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/25", "10.0.0.128/25"], network_class=BitmapNetwork)
+
+        with self.assertRaises(CidrFindrException):
+            findr.next_subnet(28)
+
+        findr.release("10.0.0.128/25")
+
+        self.assertEqual(findr.next_subnet(26), "10.0.0.128/26")
+
+    def test_selected_after_add_subnets(self):
+        """
+        A network that becomes dense through add_subnets switches to the bitmap allocator
+        """
+
+        from cidr_findr.bitmap import BitmapNetwork
+
+        subnets = packed_subnets(2000)
+
+        findr = CidrFindr(network="10.16.0.0/12")
+        findr.add_subnets(subnets)
+
+        self.assertIsInstance(findr.networks[0], BitmapNetwork)
+        self.assertEqual(findr.next_subnet(24), CidrFindr(network="10.16.0.0/12", subnets=subnets, network_class=Network).next_subnet(24))
@@ -0,0 +1,95 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr import BuddyNetwork, CidrFindr, CidrFindrException
+import random
+import unittest
+
+class BuddyNetworkTestCase(unittest.TestCase):
+    """
+    Test the buddy allocator
+    """
+
+    def test_same_as_first_fit(self):
+        """
+        The buddy allocator gives the same answers as the default search
+        """
+
+        rng = random.Random(7)
+
+        subnets = ["10.0.{}.{}/28".format(rng.randrange(16), rng.randrange(0, 256, 16)) for _ in range(80)]
+        requests = [rng.randint(22, 28) for _ in range(60)]
+
+        def allocate(findr):
+            result = []
+
+            for request in requests:
+                try:
+                    result.append(findr.next_subnet(request))
+                except CidrFindrException:
+                    result.append(None)
+
+            return result
+
+        expected = allocate(CidrFindr(network="10.0.0.0/20", subnets=subnets))
+        actual = allocate(CidrFindr(network="10.0.0.0/20", subnets=subnets, network_class=BuddyNetwork))
+
+        self.assertEqual(actual, expected)
+
+    def test_split(self):
+        """
+        A large free block is split to satisfy a small request
+        """
+
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/25"], network_class=BuddyNetwork)
+
+        self.assertEqual(findr.next_subnet(27), "10.0.0.128/27")
+        self.assertEqual(findr.next_subnet(26), "10.0.0.192/26")
+        self.assertEqual(findr.next_subnet(27), "10.0.0.160/27")
+
+    def test_release_merges_buddies(self):
+        """
+        Released blocks merge back so a larger request fits again
+        """
+
+        findr = CidrFindr(network="10.0.0.0/24", network_class=BuddyNetwork)
+
+        first = findr.next_subnet(26)
+        second = findr.next_subnet(26)
+        findr.next_subnet(25)
+
+        with self.assertRaises(CidrFindrException):
+            findr.next_subnet(25)
+
+        findr.release(first)
+        findr.release(second)
+
+        self.assertEqual(findr.next_subnet(25), "10.0.0.0/25")
+
+    def test_release_existing_subnet(self):
+        """
+        Subnets supplied up front can be released too
+        """
+
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/24"], network_class=BuddyNetwork)
+
+        findr.release("10.0.0.0/24")
+
+        self.assertEqual(findr.next_subnet(25), "10.0.0.0/25")
+
+    def test_release_unknown(self):
+        """
+        Releasing something that was never allocated is an error
+        """
+
+        findr = CidrFindr(network="10.0.0.0/24", network_class=BuddyNetwork)
+
+        with self.assertRaisesRegex(CidrFindrException, "10.0.0.0/25 is not allocated"):
+            findr.release("10.0.0.0/25")
@@ -0,0 +1,96 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr.cache import Fingerprint, TopologyCache
+import unittest
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class CacheTestCase(unittest.TestCase):
+    """
+    Test the topology cache
+    """
+
+    def test_fingerprint_order(self):
+        """
+        The fingerprint doesn't depend on the order of the CIDRs
+        """
+
+        first = Fingerprint()
+        second = Fingerprint()
+
+        self.assertEqual(list(first.track(["10.0.0.0/24", "10.0.1.0/24"])), ["10.0.0.0/24", "10.0.1.0/24"])
+        list(second.track(["10.0.1.0/24", "10.0.0.0/24"]))
+
+        self.assertEqual(first.value, second.value)
+        self.assertEqual(first.count, 2)
+
+    def test_fingerprint_change(self):
+        """
+        The fingerprint changes when a CIDR does
+        """
+
+        first = Fingerprint()
+        second = Fingerprint()
+
+        list(first.track(["10.0.0.0/24", "10.0.1.0/24"]))
+        list(second.track(["10.0.0.0/24", "10.0.2.0/24"]))
+
+        self.assertNotEqual(first.value, second.value)
+
+    def test_ttl(self):
+        """
+        Entries expire after the TTL, even when replaced
+        """
+
+        clock = FakeClock()
+        cache = TopologyCache(ttl=60, clock=clock)
+
+        cache.put("vpc-1", "first")
+
+        clock.now = 30
+        cache.put("vpc-1", "second")
+        self.assertEqual(cache.get("vpc-1"), "second")
+
+        clock.now = 60
+        self.assertIsNone(cache.get("vpc-1"))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        """
+        The least recently used entry is evicted first
+        """
+
+        cache = TopologyCache(max_size=2)
+
+        cache.put("vpc-1", 1)
+        cache.put("vpc-2", 2)
+        cache.get("vpc-1")
+        cache.put("vpc-3", 3)
+
+        self.assertEqual(cache.get("vpc-1"), 1)
+        self.assertIsNone(cache.get("vpc-2"))
+        self.assertEqual(cache.get("vpc-3"), 3)
+
+    def test_disabled(self):
+        """
+        A zero TTL stores nothing
+        """
+
+        cache = TopologyCache(ttl=0)
+
+        cache.put("vpc-1", 1)
+
+        self.assertIsNone(cache.get("vpc-1"))
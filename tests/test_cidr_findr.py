@@ -9,7 +9,9 @@ or in the "license" file accompanying this file. This file is distributed on an
 """
 
 from cidr_findr import CidrFindr, CidrFindrException
+from cidr_findr.cidr_findr import Range, parse_cidr
 from cidr_findr.lambda_utils import parse_size, sizes_valid
+import random
 import unittest
 
 class CidrFindrTestCase(unittest.TestCase):
@@ -155,7 +157,7 @@ class CidrFindrTestCase(unittest.TestCase):
         Subnet in the middle but not enough space either side
         """
 
-        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.64/25"])
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.64/26", "10.0.0.128/26"])
 
         with self.assertRaisesRegex(CidrFindrException, "Not enough space for the requested CIDR blocks"):
             findr.next_subnet(25)
@@ -245,3 +247,503 @@ class CidrFindrTestCase(unittest.TestCase):
                 vpc="10.0.0.0/16",
                 requests=[16],
             )
+
+    def test_fragmented_network(self):
+        """
+        First fit skips gaps that are too small or badly aligned
+        """
+
+        actual = self.__get_cidrs(
+            vpc="10.0.0.0/16",
+            subnets=["10.0.0.0/26", "10.0.0.128/26", "10.0.1.64/26", "10.0.2.0/25", "10.0.3.0/24"],
+            requests=[26, 25, 24, 26],
+        )
+
+        expected = ["10.0.0.64/26", "10.0.1.128/25", "10.0.4.0/24", "10.0.0.192/26"]
+
+        self.assertEqual(actual, expected)
+
+    def test_matches_linear_scan(self):
+        """
+        The free-gap search returns the same first fit as trying every aligned base
+        """
+
+        rng = random.Random(42)
+
+        network = "10.0.0.0/20"
+        network_base = Range.ip_to_num("10.0.0.0")
+        subnets = set()
+
+        for _ in range(60):
+            size = rng.randint(24, 28)
+            block = 2 ** (32 - size)
+            base = network_base + rng.randrange(0, 2 ** 12, block)
+            subnets.add(Range(base=base, size=size).to_cidr())
+
+        requests = [rng.randint(22, 28) for _ in range(40)]
+
+        taken = [Range(cidr=subnet) for subnet in subnets]
+        expected = []
+
+        for request in requests:
+            block = 2 ** (32 - request)
+
+            for base in range(network_base, network_base + 2 ** 12, block):
+                attempt = Range(base=base, size=request)
+
+                if not any(attempt.overlaps(subnet) for subnet in taken):
+                    taken.append(attempt)
+                    expected.append(attempt.to_cidr())
+                    break
+            else:
+                expected.append(None)
+
+        findr = CidrFindr(network=network, subnets=list(subnets))
+        actual = []
+
+        for request in requests:
+            try:
+                actual.append(findr.next_subnet(request))
+            except CidrFindrException:
+                actual.append(None)
+
+        self.assertEqual(actual, expected)
+
+    def test_release(self):
+        """
+        A released subnet's space is handed out again
+        """
+
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/25", "10.0.0.128/25"])
+
+        findr.release("10.0.0.0/25")
+
+        self.assertEqual(findr.next_subnet(26), "10.0.0.0/26")
+
+        with self.assertRaisesRegex(CidrFindrException, "10.0.0.64/26 is not allocated"):
+            findr.release("10.0.0.64/26")
+
+    def test_batch_largest_first(self):
+        """
+        A batch places the largest blocks first but answers in request order
+        """
+
+        findr = CidrFindr(network="10.0.0.0/23")
+
+        actual = findr.next_subnets([25, 24, 25])
+
+        expected = ["10.0.1.0/25", "10.0.0.0/24", "10.0.1.128/25"]
+
+        self.assertEqual(actual, expected)
+
+    def test_batch_avoids_fragmentation(self):
+        """
+        A small request listed first no longer blocks a large one
+        """
+
+        with self.assertRaises(CidrFindrException):
+            self.__get_cidrs(vpc="10.0.0.0/23", subnets=["10.0.1.0/25"], requests=[25, 24])
+
+        findr = CidrFindr(network="10.0.0.0/23", subnets=["10.0.1.0/25"])
+
+        self.assertEqual(findr.next_subnets([25, 24]), ["10.0.1.128/25", "10.0.0.0/24"])
+
+    def test_batch_all_or_nothing(self):
+        """
+        A failing batch leaves no partial allocations behind
+        """
+
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/26"])
+
+        with self.assertRaisesRegex(CidrFindrException, "Not enough space for the requested CIDR blocks"):
+            findr.next_subnets([26, 25, 25])
+
+        self.assertEqual([str(subnet) for subnet in findr.networks[0].subnets], ["10.0.0.0/26"])
+        self.assertEqual(findr.next_subnets([25, 26]), ["10.0.0.128/25", "10.0.0.64/26"])
+
+    def test_add_subnets(self):
+        """
+        Subnets added after construction are avoided
+        """
+
+        findr = CidrFindr(networks=["10.0.0.0/24", "10.0.1.0/24"])
+
+        findr.add_subnets(["10.0.0.0/25"])
+        findr.add_subnets(["10.0.0.128/26", "10.0.1.0/26"])
+
+        self.assertEqual(findr.next_subnets([26, 25]), ["10.0.0.192/26", "10.0.1.128/25"])
+
+    def test_numeric_network_order(self):
+        """
+        Networks are tried lowest address first, not in string order
+        """
+
+        findr = CidrFindr(networks=["10.0.10.0/24", "10.0.2.0/24", "2001:db8::/56", "9.0.0.0/24"])
+
+        self.assertEqual([str(network.network) for network in findr.networks], ["9.0.0.0/24", "10.0.2.0/24", "10.0.10.0/24", "2001:db8::/56"])
+        self.assertEqual(findr.next_subnets([25, 25, 25]), ["9.0.0.0/25", "9.0.0.128/25", "10.0.2.0/25"])
+
+    def test_subnet_spanning_networks(self):
+        findr = CidrFindr(networks=["10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24"], subnets=["10.0.0.0/23", "10.0.2.0/25"])
+
+        self.assertEqual([len(network.subnets) for network in findr.networks], [1, 1, 1])
+        self.assertEqual(findr.next_subnet(25), "10.0.2.128/25")
+
+    def test_subnet_outside_networks(self):
+        findr = CidrFindr(networks=["10.0.0.0/24", "2001:db8::/56"], subnets=["9.0.0.0/8", "10.0.1.0/24", "2001:db8:1::/64", "10.0.0.0/25"])
+
+        self.assertEqual([[str(subnet) for subnet in network.subnets] for network in findr.networks], [["10.0.0.0/25"], []])
+
+    def test_assignment_matches_overlaps(self):
+        """
+        The sweep gives each network exactly the subnets that overlap it
+        """
+
+        rng = random.Random(20)
+
+        for _ in range(50):
+            networks = set()
+            subnets = []
+
+            for _ in range(rng.randint(1, 6)):
+                size = rng.randint(20, 26)
+                networks.add(str(Range(base=rng.randrange(0, 1 << 12) << 20 >> size << size, size=size)))
+
+            for _ in range(rng.randint(0, 40)):
+                size = rng.randint(18, 30)
+                subnets.append(str(Range(base=rng.randrange(0, 1 << 32) >> (32 - size) << (32 - size), size=size)))
+
+            findr = CidrFindr(networks=networks, subnets=subnets)
+
+            for network in findr.networks:
+                expected = sorted(subnet for subnet in subnets if Range(cidr=subnet).overlaps(network.network))
+
+                self.assertEqual(sorted(str(subnet) for subnet in network.subnets), expected)
+
+    def test_skips_full_networks(self):
+        """
+        A network that couldn't fit a request isn't searched again for one as large
+        """
+
+        findr = CidrFindr(networks=["10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24"], subnets=["10.0.0.0/25", "10.0.0.128/26", "10.0.1.0/24"])
+
+        self.assertEqual(findr.next_subnet(25), "10.0.2.0/25")
+        self.assertEqual([network.searches for network in findr.networks], [1, 1, 1])
+
+        self.assertEqual(findr.next_subnet(25), "10.0.2.128/25")
+        self.assertEqual([network.searches for network in findr.networks], [1, 1, 2])
+
+        # Smaller requests are still tried in network order
+        self.assertEqual(findr.next_subnet(26), "10.0.0.192/26")
+
+        findr.release("10.0.2.0/25")
+
+        self.assertEqual(findr.next_subnet(25), "10.0.2.0/25")
+
+    def test_try_next_subnet(self):
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/25"])
+        network = findr.networks[0]
+
+        self.assertIsNone(network.try_next_subnet(24))
+        self.assertIsNone(network.try_next_subnet(33))
+        self.assertEqual(network.try_next_subnet(25), "10.0.0.128/25")
+        self.assertIsNone(network.try_next_subnet(25))
+
+    def test_never_whole_network(self):
+        """
+        Asking about free space doesn't let the whole network be handed out
+        """
+
+        findr = CidrFindr(network="10.0.0.0/16")
+        network = findr.networks[0]
+
+        network.fragmentation()
+
+        self.assertIsNone(network.try_next_subnet(16))
+
+        with self.assertRaises(CidrFindrException):
+            findr.next_subnet(16)
+
+        self.assertEqual(findr.next_subnet(17), "10.0.0.0/17")
+
+class FreeSpaceTestCase(unittest.TestCase):
+    """
+    Test the free space queries
+    """
+
+    def setUp(self):
+        self.findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/26", "10.0.0.128/27"])
+
+    def test_free_space(self):
+        network = self.findr.networks[0]
+
+        self.assertEqual(network.free_addresses(), 160)
+        self.assertEqual(network.free_blocks(), {26: 2, 27: 1})
+        self.assertEqual(network.largest_free_prefix(), 26)
+        self.assertAlmostEqual(network.fragmentation(), 0.6)
+
+    def test_across_networks(self):
+        findr = CidrFindr(networks=["10.0.0.0/24", "10.1.0.0/23", "2001:db8::/56"], subnets=["10.1.0.0/24"])
+
+        self.assertEqual(findr.free_addresses(), 512)
+        self.assertEqual(findr.free_blocks(), {24: 2})
+        self.assertEqual(findr.largest_free_prefix(), 24)
+        self.assertAlmostEqual(findr.fragmentation(), 0.5)
+
+        self.assertEqual(findr.free_blocks(version=6), {56: 1})
+        self.assertEqual(findr.fragmentation(version=6), 0.0)
+
+    def test_full(self):
+        findr = CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.0/24"])
+
+        self.assertEqual(findr.free_addresses(), 0)
+        self.assertEqual(findr.free_blocks(), {})
+        self.assertIsNone(findr.largest_free_prefix())
+        self.assertEqual(findr.fragmentation(), 0.0)
+
+        with self.assertRaisesRegex(CidrFindrException, "no free space left"):
+            findr.next_subnet(28)
+
+    def test_empty_network(self):
+        """
+        An empty network is reported as its two halves, since it can't be allocated whole
+        """
+
+        findr = CidrFindr(network="10.0.0.0/16")
+
+        self.assertEqual(findr.largest_free_prefix(), 17)
+        self.assertEqual(findr.networks[0].largest_free_prefix(), 17)
+        self.assertEqual(findr.fragmentation(), 0.0)
+
+        with self.assertRaisesRegex(CidrFindrException, "a /17 or smaller would fit"):
+            findr.next_subnet(16)
+
+        self.assertIsNone(CidrFindr(network="10.0.0.1/32").largest_free_prefix())
+
+    def test_tracks_allocations(self):
+        self.findr.next_subnet(26)
+
+        self.assertEqual(self.findr.free_blocks(), {26: 1, 27: 1})
+
+    def test_failure_reason(self):
+        """
+        A failed batch reports what would fit once it is rolled back
+        """
+
+        with self.assertRaisesRegex(CidrFindrException, "a /26 or smaller would fit"):
+            self.findr.next_subnets([26, 26, 26])
+
+        self.assertEqual(self.findr.free_addresses(), 160)
+
+    def test_iter_free(self):
+        network = self.findr.networks[0]
+
+        self.assertEqual(list(network.iter_free(26)), ["10.0.0.64/26", "10.0.0.192/26"])
+        self.assertEqual(list(network.iter_free(27)), ["10.0.0.64/27", "10.0.0.96/27", "10.0.0.160/27", "10.0.0.192/27", "10.0.0.224/27"])
+        self.assertEqual(list(network.iter_free(25)), [])
+        self.assertEqual(list(network.iter_free(24)), [])
+
+        # Nothing is allocated
+        self.assertEqual(network.free_addresses(), 160)
+
+    def test_iter_free_offset_and_limit(self):
+        expected = list(self.findr.iter_free(28))
+
+        self.assertEqual(len(expected), 10)
+
+        for offset in range(12):
+            for limit in (None, 0, 1, 3, 20):
+                end = None if limit is None else offset + limit
+
+                self.assertEqual(list(self.findr.iter_free(28, offset=offset, limit=limit)), expected[offset:end])
+
+    def test_iter_free_across_networks(self):
+        findr = CidrFindr(networks=["10.1.0.0/23", "10.0.0.0/24", "2001:db8::/56"], subnets=["10.1.0.0/24", "10.0.0.0/25"])
+
+        self.assertEqual(list(findr.iter_free(25)), ["10.0.0.128/25", "10.1.1.0/25", "10.1.1.128/25"])
+        self.assertEqual(list(findr.iter_free(25, offset=1, limit=1)), ["10.1.1.0/25"])
+        self.assertEqual(list(findr.iter_free(58, version=6, limit=2)), ["2001:db8::/58", "2001:db8:0:40::/58"])
+
+    def test_iter_free_is_lazy(self):
+        """
+        Candidates in a huge space are produced as they are asked for
+        """
+
+        findr = CidrFindr(network="2001:db8::/32")
+        candidates = findr.iter_free(64, version=6, offset=1 << 31)
+
+        self.assertEqual(next(candidates), "2001:db8:8000::/64")
+        self.assertEqual(next(candidates), "2001:db8:8000:1::/64")
+
+    def test_iter_free_matches_allocation(self):
+        """
+        The candidates are the blocks next_subnet would hand out, in the same order
+        """
+
+        candidates = list(self.findr.iter_free(27))
+
+        self.assertEqual([self.findr.next_subnet(27) for _ in candidates], candidates)
+        self.assertEqual(list(self.findr.iter_free(27)), [])
+
+    def test_iter_free_invalid(self):
+        with self.assertRaisesRegex(CidrFindrException, "/33 is not a valid IPv4 prefix"):
+            self.findr.iter_free(33)
+
+        with self.assertRaisesRegex(CidrFindrException, "/33 is not a valid IPv4 prefix"):
+            self.findr.networks[0].iter_free(33)
+
+        with self.assertRaisesRegex(CidrFindrException, "Offset can't be negative: -1"):
+            self.findr.iter_free(28, offset=-1, limit=2)
+
+        with self.assertRaisesRegex(CidrFindrException, "Limit can't be negative: -1"):
+            self.findr.networks[0].iter_free(28, limit=-1)
+
+class RangeTestCase(unittest.TestCase):
+    """
+    Test the Range class
+    """
+
+    def test_from_top(self):
+        """
+        A range can be given by its base and top addresses
+        """
+
+        actual = Range(base="10.0.4.0", top="10.0.8.0")
+
+        self.assertEqual(actual.to_cidr(), "10.0.4.0/22")
+
+    def test_from_top_not_a_block(self):
+        """
+        A base and top that don't describe a CIDR block are rejected
+        """
+
+        with self.assertRaisesRegex(CidrFindrException, "10.0.4.0 to 10.0.7.0 is not a CIDR block"):
+            Range(base="10.0.4.0", top="10.0.7.0")
+
+    def test_overlaps_and_contains(self):
+        """
+        Overlap and containment follow the prefix bits
+        """
+
+        network = Range(cidr="10.0.0.0/16")
+        inside = Range(cidr="10.0.4.0/22")
+        outside = Range(cidr="10.1.0.0/24")
+
+        self.assertTrue(network.overlaps(inside))
+        self.assertTrue(inside.overlaps(network))
+        self.assertFalse(network.overlaps(outside))
+        self.assertTrue(network.contains(inside))
+        self.assertFalse(inside.contains(network))
+        self.assertFalse(network.contains(outside))
+
+    def test_no_instance_dict(self):
+        """
+        Ranges don't carry a per-instance __dict__
+        """
+
+        self.assertFalse(hasattr(Range(cidr="10.0.0.0/24"), "__dict__"))
+
+class Ipv6TestCase(unittest.TestCase):
+    """
+    Test IPv6 allocation
+    """
+
+    def test_no_subnets(self):
+        """
+        The first /64 of an empty /56
+        """
+
+        findr = CidrFindr(network="2001:db8:0:100::/56")
+
+        self.assertEqual(findr.next_subnets([64, 64], version=6), ["2001:db8:0:100::/64", "2001:db8:0:101::/64"])
+
+    def test_large_space(self):
+        """
+        A /48 with its first half taken is searched without walking every /64
+        """
+
+        findr = CidrFindr(network="2001:db8::/48", subnets=["2001:db8::/49", "2001:db8:0:8000::/64"])
+
+        self.assertEqual(findr.next_subnet(64, version=6), "2001:db8:0:8001::/64")
+        self.assertEqual(findr.next_subnet(56, version=6), "2001:db8:0:8100::/56")
+
+    def test_mixed_families(self):
+        """
+        IPv4 and IPv6 requests only use networks of their own family
+        """
+
+        findr = CidrFindr(
+            networks=["10.0.0.0/24", "2001:db8::/56"],
+            subnets=["10.0.0.0/25", "2001:db8::/64"],
+        )
+
+        self.assertEqual(findr.next_subnet(25), "10.0.0.128/25")
+        self.assertEqual(findr.next_subnet(64, version=6), "2001:db8:0:1::/64")
+
+        with self.assertRaisesRegex(CidrFindrException, "Not enough space for the requested CIDR blocks"):
+            findr.next_subnet(64)
+
+    def test_ipv6_range(self):
+        """
+        IPv6 ranges format in their compressed form
+        """
+
+        actual = Range(base="2001:db8::", top="2001:db8:0:1::")
+
+        self.assertEqual(actual.to_cidr(), "2001:db8::/64")
+        self.assertEqual(actual.version, 6)
+        self.assertFalse(actual.overlaps(Range(cidr="0.0.0.0/0")))
+
+class ParseTestCase(unittest.TestCase):
+    """
+    Test CIDR parsing
+    """
+
+    def test_parse(self):
+        """
+        Both address families parse to integers
+        """
+
+        self.assertEqual(parse_cidr("10.0.1.0/24"), (0x0A000100, 24, 32))
+        self.assertEqual(parse_cidr("2001:db8::/32"), (0x20010DB8 << 96, 32, 128))
+
+    def test_invalid(self):
+        """
+        Malformed CIDR blocks are rejected
+        """
+
+        cases = (
+            "10.0.0.0",
+            "10.0.0/24",
+            "10.0.0.256/24",
+            "010.0.0.0/24",
+            "10.0.0.0/33",
+            "10.0.0.0/-1",
+            "10.0.0.0/twenty",
+            "10.0.0.0/",
+            "10.0.0.0/\u0662\u0664",
+            "10.0.0.0/24/24",
+            "2001:db8::/129",
+            "",
+            None,
+        )
+
+        for case in cases:
+            with self.assertRaisesRegex(CidrFindrException, "Invalid CIDR block"):
+                parse_cidr(case)
+
+    def test_host_bits(self):
+        """
+        CIDR blocks with host bits set are rejected
+        """
+
+        with self.assertRaisesRegex(CidrFindrException, "Invalid CIDR block 10.0.0.64/25: host bits are set"):
+            CidrFindr(network="10.0.0.0/24", subnets=["10.0.0.64/25"])
+
+    def test_format(self):
+        """
+        Numbers format back to addresses
+        """
+
+        self.assertEqual(Range.num_to_ip(0x0A000100), "10.0.1.0")
+        self.assertEqual(Range.num_to_ip(0x20010DB8 << 96, 128), "2001:db8::")
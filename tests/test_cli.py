@@ -0,0 +1,189 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr import cli
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+VPCS = {
+    "Vpcs": [
+        {
+            "VpcId": "vpc-{}".format(i),
+            "CidrBlockAssociationSet": [{"CidrBlock": "10.{}.0.0/16".format(i)}],
+        }
+        for i in range(20)
+    ] + [
+        {
+            "VpcId": "vpc-ipv6",
+            "CidrBlockAssociationSet": [{"CidrBlock": "192.168.0.0/24"}],
+            "Ipv6CidrBlockAssociationSet": [{"Ipv6CidrBlock": "2001:db8::/56"}],
+        },
+    ],
+}
+
+SUBNETS = {
+    "Subnets": [
+        {"VpcId": "vpc-{}".format(i), "CidrBlock": "10.{}.{}.0/24".format(i, j)}
+        for i in range(20)
+        for j in range(i)
+    ] + [
+        {
+            "VpcId": "vpc-ipv6",
+            "CidrBlock": "192.168.0.0/25",
+            "Ipv6CidrBlockAssociationSet": [{"Ipv6CidrBlock": "2001:db8::/64"}],
+        },
+    ],
+}
+
+class CliTestCase(unittest.TestCase):
+    """
+    Test the offline planning command
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.vpcs = self.__write("vpcs.json", json.dumps(VPCS))
+        self.subnets = self.__write("subnets.json", json.dumps(SUBNETS))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+
+        with open(path, "w") as f:
+            f.write(content)
+
+        return path
+
+    def __run(self, requests, *args):
+        source = self.__write("requests.jsonl", "".join(json.dumps(request) + "\n" for request in requests))
+        output = os.path.join(self.directory.name, "output.jsonl")
+
+        status = cli.main([source, "--output", output, "--vpcs", self.vpcs, "--subnets", self.subnets] + list(args))
+
+        with open(output) as f:
+            return status, [json.loads(line) for line in f]
+
+    def test_plan(self):
+        requests = [{"VpcId": "vpc-{}".format(i), "Sizes": [24, 25]} for i in range(20)]
+
+        status, results = self.__run(requests, "--workers", "0")
+
+        self.assertEqual(status, 0)
+        self.assertEqual(results, [
+            {
+                "VpcId": "vpc-{}".format(i),
+                "CidrBlocks": ["10.{}.{}.0/24".format(i, i), "10.{}.{}.0/25".format(i, i + 1)],
+                "Ipv6CidrBlocks": [],
+            }
+            for i in range(20)
+        ])
+
+    def test_process_pool(self):
+        """
+        Results come back in input order whatever order the workers finish in
+        """
+
+        requests = [{"VpcId": "vpc-{}".format(i % 20), "Sizes": [20]} for i in range(50)]
+
+        self.assertEqual(self.__run(requests, "--workers", "2", "--window", "3"), self.__run(requests, "--workers", "0"))
+
+    def test_ipv6_and_inline(self):
+        requests = [
+            {"VpcId": "vpc-ipv6", "Sizes": [26], "Ipv6Sizes": [64]},
+            {
+                "VpcId": "vpc-inline",
+                "Vpc": {"CidrBlockAssociationSet": [{"CidrBlock": "172.16.0.0/24"}]},
+                "Subnets": [{"CidrBlock": "172.16.0.0/26"}],
+                "Sizes": [26],
+            },
+        ]
+
+        status, results = self.__run(requests, "--workers", "0")
+
+        self.assertEqual(status, 0)
+        self.assertEqual(results, [
+            {"VpcId": "vpc-ipv6", "CidrBlocks": ["192.168.0.128/26"], "Ipv6CidrBlocks": ["2001:db8:0:1::/64"]},
+            {"VpcId": "vpc-inline", "CidrBlocks": ["172.16.0.64/26"], "Ipv6CidrBlocks": []},
+        ])
+
+    def test_errors(self):
+        requests = [
+            {"VpcId": "vpc-missing", "Sizes": [24]},
+            {"VpcId": "vpc-1", "Sizes": [8]},
+            {"VpcId": "vpc-1", "Sizes": [16]},
+            {"VpcId": "vpc-1", "Sizes": [24]},
+        ]
+
+        status, results = self.__run(requests, "--workers", "0")
+
+        self.assertEqual(status, 1)
+        self.assertEqual(results[0], {"VpcId": "vpc-missing", "Error": "Unknown VPC: vpc-missing"})
+        self.assertEqual(results[1], {"VpcId": "vpc-1", "Error": "An invalid subnet size was specified: 8"})
+        self.assertRegex(results[2]["Error"], "Not enough space")
+        self.assertEqual(results[3]["CidrBlocks"], ["10.1.1.0/24"])
+
+    def test_bad_lines(self):
+        """
+        A bad input line gets an error line and the run carries on
+        """
+
+        source = self.__write("requests.jsonl", "\n".join([
+            json.dumps({"VpcId": "vpc-1", "Sizes": [24]}),
+            "not json",
+            "[1, 2]",
+            json.dumps({"VpcId": "vpc-inline", "Vpc": {}, "Sizes": [24]}),
+            json.dumps({"VpcId": "vpc-1", "Sizes": 24}),
+            json.dumps({"VpcId": "vpc-2", "Sizes": [24]}),
+        ]) + "\n")
+        output = os.path.join(self.directory.name, "output.jsonl")
+
+        for workers in ("0", "2"):
+            status = cli.main([source, "--output", output, "--vpcs", self.vpcs, "--subnets", self.subnets, "--workers", workers])
+
+            with open(output) as f:
+                results = [json.loads(line) for line in f]
+
+            self.assertEqual(status, 1)
+            self.assertEqual(len(results), 6)
+            self.assertEqual(results[0]["CidrBlocks"], ["10.1.1.0/24"])
+            self.assertRegex(results[1]["Error"], "^Invalid JSON: ")
+            self.assertEqual(results[2], {"Error": "Invalid request: expected a JSON object"})
+            self.assertEqual(results[3], {"VpcId": "vpc-inline", "Error": "Invalid request: KeyError: 'CidrBlockAssociationSet'"})
+            self.assertEqual(results[4]["VpcId"], "vpc-1")
+            self.assertRegex(results[4]["Error"], "^Invalid request: TypeError")
+            self.assertEqual(results[5]["CidrBlocks"], ["10.2.2.0/24"])
+
+    def test_module(self):
+        """
+        python -m cidr_findr streams standard input to standard output and reports throughput
+        """
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        process = subprocess.run(
+            [sys.executable, "-m", "cidr_findr", "--vpcs", self.vpcs, "--subnets", self.subnets, "--workers", "2"],
+            input='{"VpcId": "vpc-3", "Sizes": [24]}\n',
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            cwd=root,
+            timeout=60,
+        )
+
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual(json.loads(process.stdout), {"VpcId": "vpc-3", "CidrBlocks": ["10.3.3.0/24"], "Ipv6CidrBlocks": []})
+        self.assertRegex(process.stderr, r"Planned 1 VPCs \(0 failed\) in [0-9.]+s")
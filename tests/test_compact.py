@@ -0,0 +1,148 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr import ArrayNetwork, CidrFindr, CidrFindrException, Network
+from cidr_findr.cidr_findr import Range
+from cidr_findr.compact import SubnetColumns
+from unittest import mock
+import random
+import unittest
+
+class ArrayNetworkTestCase(unittest.TestCase):
+    """
+    Test the array-backed network
+    """
+
+    def test_same_as_list(self):
+        """
+        Allocating and releasing gives the same answers as a plain Network
+        """
+
+        rng = random.Random(21)
+
+        for _ in range(30):
+            subnets = []
+
+            for _ in range(rng.randint(0, 60)):
+                size = rng.randint(17, 28)
+                subnets.append(str(Range(base=(10 << 24 | rng.randrange(1 << 17)) >> (32 - size) << (32 - size), size=size)))
+
+            networks = ["10.0.0.0/16", "10.1.0.0/20"]
+            plain = CidrFindr(networks=networks, subnets=subnets, network_class=Network)
+            compact = CidrFindr(networks=networks, subnets=subnets, network_class=ArrayNetwork)
+            allocated = []
+
+            for _ in range(30):
+                if allocated and rng.random() < 0.3:
+                    cidr = allocated.pop(rng.randrange(len(allocated)))
+
+                    plain.release(cidr)
+                    compact.release(cidr)
+                    continue
+
+                request = rng.randint(18, 28)
+
+                try:
+                    expected = plain.next_subnet(request)
+                except CidrFindrException:
+                    expected = None
+
+                try:
+                    actual = compact.next_subnet(request)
+                except CidrFindrException:
+                    actual = None
+
+                self.assertEqual(actual, expected)
+
+                if expected:
+                    allocated.append(expected)
+
+            for before, after in zip(plain.networks, compact.networks):
+                self.assertEqual(sorted(map(str, after.subnets)), sorted(map(str, before.subnets)))
+                self.assertEqual(list(after.free_gaps()), list(before.free_gaps()))
+                self.assertEqual(list(after.iter_free(24, offset=2, limit=50)), list(before.iter_free(24, offset=2, limit=50)))
+
+    def test_streamed_assignment(self):
+        """
+        Subnets streamed to the networks land where the sorted sweep puts them,
+        without a Range being kept for each
+        """
+
+        networks = ["10.1.0.0/16", "10.0.0.0/24", "10.0.1.0/24"]
+        subnets = ["10.0.0.0/23", "10.1.5.0/24", "10.0.1.128/25", "192.168.0.0/24", "2001:db8::/64", "10.1.0.0/24"]
+
+        plain = CidrFindr(networks=networks, subnets=subnets, network_class=Network)
+
+        with mock.patch.object(CidrFindr, "add_subnets", side_effect=AssertionError("sorted")):
+            compact = CidrFindr(networks=networks, subnets=subnets, network_class=ArrayNetwork)
+
+        for before, after in zip(plain.networks, compact.networks):
+            self.assertEqual(sorted(map(str, after.subnets)), sorted(map(str, before.subnets)))
+
+        self.assertEqual(compact.next_subnets([24, 25]), plain.next_subnets([24, 25]))
+
+    def test_release_keeps_overlapping(self):
+        """
+        Releasing a block leaves space still held by a larger existing subnet
+        """
+
+        findr = CidrFindr(network="10.0.0.0/16", subnets=["10.0.0.0/23", "10.0.0.0/24"], network_class=ArrayNetwork)
+
+        findr.release("10.0.0.0/24")
+
+        self.assertEqual(findr.next_subnet(24), "10.0.2.0/24")
+
+    def test_ipv4_only(self):
+        with self.assertRaisesRegex(CidrFindrException, "2001:db8::/56 is not an IPv4 network"):
+            CidrFindr(network="2001:db8::/56", network_class=ArrayNetwork)
+
+class SubnetColumnsTestCase(unittest.TestCase):
+    """
+    Test the packed subnet store
+    """
+
+    def test_sorted(self):
+        columns = SubnetColumns()
+
+        for cidr in ["10.0.2.0/24", "10.0.0.0/24", "10.0.0.0/16"]:
+            columns.defer(Range(cidr=cidr))
+
+        columns.append(Range(cidr="10.0.1.0/24"))
+
+        self.assertEqual(len(columns), 4)
+        self.assertEqual([str(subnet) for subnet in columns], ["10.0.0.0/16", "10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24"])
+        self.assertEqual(str(columns[-1]), "10.0.2.0/24")
+        self.assertEqual(columns.bases.itemsize, 4)
+        self.assertEqual(columns.sizes.itemsize, 1)
+
+    def test_contains_and_remove(self):
+        columns = SubnetColumns()
+        columns.append(Range(cidr="10.0.0.0/24"))
+
+        self.assertIn(Range(cidr="10.0.0.0/24"), columns)
+        self.assertNotIn(Range(cidr="10.0.0.0/25"), columns)
+        self.assertNotIn(Range(cidr="2001:db8::/64"), columns)
+
+        columns.remove(Range(cidr="10.0.0.0/24"))
+
+        self.assertEqual(len(columns), 0)
+
+        with self.assertRaises(ValueError):
+            columns.remove(Range(cidr="10.0.0.0/24"))
+
+    def test_overlapping(self):
+        columns = SubnetColumns()
+
+        for cidr in ["10.0.0.0/16", "10.0.4.0/22", "10.0.5.0/24", "10.0.5.128/25", "10.0.6.0/24", "10.1.0.0/24"]:
+            columns.defer(Range(cidr=cidr))
+
+        overlapping = sorted(str(subnet) for subnet in columns.overlapping(Range(cidr="10.0.5.0/24")))
+
+        self.assertEqual(overlapping, ["10.0.0.0/16", "10.0.4.0/22", "10.0.5.0/24", "10.0.5.128/25"])
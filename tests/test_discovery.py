@@ -0,0 +1,73 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr.discovery import Prefetch, get_executor, subnet_cidrs
+import itertools
+import unittest
+
+class DiscoveryTestCase(unittest.TestCase):
+    """
+    Test the EC2 discovery helpers
+    """
+
+    def test_subnet_cidrs(self):
+        """
+        IPv4 and IPv6 blocks are both read from a subnet
+        """
+
+        subnet = {
+            "CidrBlock": "10.0.0.0/24",
+            "Ipv6CidrBlockAssociationSet": [{"Ipv6CidrBlock": "2001:db8::/64"}],
+        }
+
+        self.assertEqual(subnet_cidrs(subnet), ["10.0.0.0/24", "2001:db8::/64"])
+        self.assertEqual(subnet_cidrs({"Ipv6CidrBlockAssociationSet": []}), [])
+
+    def test_prefetch(self):
+        """
+        Prefetched items arrive in order
+        """
+
+        self.assertEqual(list(Prefetch(get_executor(), range(10), size=2)), list(range(10)))
+
+    def test_prefetch_error(self):
+        """
+        An error in the producer is raised in the consumer
+        """
+
+        def pages():
+            yield 1
+            raise ValueError("broken page")
+
+        prefetch = Prefetch(get_executor(), pages())
+
+        with self.assertRaisesRegex(ValueError, "broken page"):
+            list(prefetch)
+
+    def test_prefetch_close(self):
+        """
+        Closing stops a producer that is waiting on a full queue
+        """
+
+        produced = []
+
+        def pages():
+            for i in itertools.count():
+                produced.append(i)
+                yield i
+
+        prefetch = Prefetch(get_executor(), pages(), size=1)
+
+        self.assertEqual(next(iter(prefetch)), 0)
+
+        prefetch.close()
+
+        # The producer gives up instead of running on, and the pool is free for other work
+        self.assertLess(get_executor().submit(len, produced).result(timeout=5), 10)
@@ -0,0 +1,63 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative `python -X importtime` cost of `import cidr_findr`, in microseconds.
+# Importing boto3 alone costs several times this.
+IMPORT_TIME_BUDGET_US = 150000
+
+def run_python(*args):
+    return subprocess.run(
+        [sys.executable] + list(args),
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+class ImportTimeTestCase(unittest.TestCase):
+    """
+    Test the cost of importing the package
+    """
+
+    def test_no_heavy_imports(self):
+        """
+        Importing the package doesn't import boto3, urllib.request or numpy
+        """
+
+        output = run_python("-c", "import cidr_findr, sys; print(sorted(set(sys.modules) & {'boto3', 'urllib.request', 'numpy'}))")
+
+        self.assertEqual(output.stdout.strip(), "[]")
+
+    def test_import_time_budget(self):
+        """
+        Importing the package stays within its recorded budget
+        """
+
+        timings = []
+
+        for _ in range(3):
+            output = run_python("-X", "importtime", "-c", "import cidr_findr")
+
+            for line in output.stderr.splitlines():
+                fields = line.split("|")
+
+                if len(fields) == 3 and fields[2].strip() == "cidr_findr":
+                    timings.append(int(fields[1]))
+
+        self.assertEqual(len(timings), 3)
+        self.assertLessEqual(min(timings), IMPORT_TIME_BUDGET_US)
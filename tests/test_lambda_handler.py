@@ -11,10 +11,30 @@ or in the "license" file accompanying this file. This file is distributed on an
 #import cidr_findr
 from cidr_findr import lambda_utils
 import cidr_findr.lambda_handler
-from cidr_findr.lambda_handler import handler
+from cidr_findr import discovery
+from cidr_findr import CidrFindr
+from cidr_findr.lambda_handler import batch_handler, free_space, handler, physical_resource_id, response_cache, topology_cache
+from cidr_findr.metrics import Metrics
+from cidr_findr.reservations import SqliteReservations
+from unittest import mock
+import json
+import os
+import tempfile
+import threading
 import unittest
 
+class MockPaginator():
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        for page in self.pages(**kwargs):
+            yield page
+
 class MockEc2():
+    def get_paginator(self, operation):
+        return MockPaginator(lambda **kwargs: [getattr(self, operation)(**kwargs)])
+
     def describe_vpcs(self, **kwargs):
         return {
             "Vpcs": [
@@ -46,18 +66,67 @@ class MockEc2():
             ]
         }
 
+class MockEc2Ipv6(MockEc2):
+    def describe_vpcs(self, **kwargs):
+        response = super().describe_vpcs(**kwargs)
+
+        response["Vpcs"][0]["Ipv6CidrBlockAssociationSet"] = [
+            {
+                "Ipv6CidrBlock": "2001:db8:1234:1a00::/56",
+            },
+        ]
+
+        return response
+
+    def describe_subnets(self, **kwargs):
+        response = super().describe_subnets(**kwargs)
+
+        response["Subnets"][0]["Ipv6CidrBlockAssociationSet"] = [
+            {
+                "Ipv6CidrBlock": "2001:db8:1234:1a00::/64",
+            },
+        ]
+
+        response["Subnets"].append({
+            "Ipv6CidrBlockAssociationSet": [
+                {
+                    "Ipv6CidrBlock": "2001:db8:1234:1a01::/64",
+                },
+            ],
+        })
+
+        return response
+
+class MockEc2Paged(MockEc2):
+    """
+    Returns one subnet per page
+    """
+
+    def get_paginator(self, operation):
+        def pages(**kwargs):
+            for subnet in self.describe_subnets(**kwargs)["Subnets"]:
+                yield {"Subnets": [subnet]}
+
+        return MockPaginator(pages)
+
 class LambdaHandlerTestCase(unittest.TestCase):
     """
     Test the lambda handler function
     """
 
-    def __responder(self, event, context, status, reason=None, response_data={}):
+    def setUp(self):
+        topology_cache.clear()
+        response_cache.clear()
+
+    def __responder(self, event, context, status, reason=None, response_data={}, physical_resource_id=None):
         self.response = {
             "status": status,
             "reason": reason,
             "data": response_data,
         }
 
+        self.physical_resource_id = physical_resource_id
+
     def test_delete(self):
         expected = {
             "status": "SUCCESS",
@@ -144,7 +213,7 @@ class LambdaHandlerTestCase(unittest.TestCase):
     def test_request_too_large(self):
         expected = {
             "status": "FAILED",
-            "reason": "Not enough space for the requested CIDR blocks",
+            "reason": "Not enough space for the requested CIDR blocks: a /17 or smaller would fit",
             "data": {},
         }
 
@@ -186,3 +255,766 @@ class LambdaHandlerTestCase(unittest.TestCase):
         handler(request, {}, responder=self.__responder, client=MockEc2())
 
         self.assertEqual(self.response, expected)
+
+    def test_bad_ipv6_sizes(self):
+        expected = {
+            "status": "FAILED",
+            "reason": "An invalid IPv6 subnet size was specified: 64, 65",
+            "data": {},
+        }
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": [],
+                "Ipv6Sizes": ["64", "65"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2Ipv6())
+
+        self.assertEqual(self.response, expected)
+
+    def test_bad_integer_sizes(self):
+        """
+        Sizes given as numbers rather than strings are reported too
+        """
+
+        for properties, reason in (
+            ({"Sizes": [24, 8]}, "An invalid subnet size was specified: 24, 8"),
+            ({"Sizes": [], "Ipv6Sizes": [64, 65]}, "An invalid IPv6 subnet size was specified: 64, 65"),
+        ):
+            properties["VpcId"] = ""
+
+            handler({"RequestType": "Create", "ResourceProperties": properties}, {}, responder=self.__responder, client=MockEc2Ipv6())
+
+            self.assertEqual(self.response, {"status": "FAILED", "reason": reason, "data": {}})
+
+    def test_ipv6_success(self):
+        """
+        IPv6 blocks are returned alongside the IPv4 ones
+        """
+
+        expected = {
+            "status": "SUCCESS",
+            "reason": None,
+            "data": {
+                "CidrBlock1": "10.0.2.0/24",
+                "Ipv6CidrBlock1": "2001:db8:1234:1a02::/64",
+                "Ipv6CidrBlock2": "2001:db8:1234:1a03::/64",
+            },
+        }
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": ["24"],
+                "Ipv6Sizes": ["64", "64"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2Ipv6())
+
+        self.assertEqual(self.response, expected)
+
+    def test_paged_subnets(self):
+        """
+        Subnets on every page are taken into account
+        """
+
+        expected = {
+            "status": "SUCCESS",
+            "reason": None,
+            "data": {
+                "CidrBlock1": "10.0.1.128/25",
+                "CidrBlock2": "10.0.128.0/17",
+                "CidrBlock3": "10.1.128.0/17",
+            },
+        }
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": ["25", "17", "17"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2Paged())
+
+        self.assertEqual(self.response, expected)
+
+    def test_discovery_error(self):
+        """
+        A failure listing subnets is reported
+        """
+
+        class BrokenEc2(MockEc2):
+            def describe_subnets(self, **kwargs):
+                raise Exception("Rate exceeded")
+
+        expected = {
+            "status": "FAILED",
+            "reason": "Rate exceeded",
+            "data": {},
+        }
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=BrokenEc2())
+
+        self.assertEqual(self.response, expected)
+
+    def test_cached_allocations(self):
+        """
+        Back-to-back requests for the same VPC get different blocks
+        """
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.3.0/24"})
+
+    def test_cache_invalidated(self):
+        """
+        A change to the VPC's subnets rebuilds the cached state but keeps recent allocations
+        """
+
+        class GrowingEc2(MockEc2):
+            calls = 0
+
+            def describe_subnets(self, **kwargs):
+                self.calls += 1
+
+                response = super().describe_subnets(**kwargs)
+                response["Subnets"].append({"CidrBlock": "10.0.3.0/24"})
+                return response
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+
+        lines = []
+        client = GrowingEc2()
+
+        handler(request, {}, responder=self.__responder, client=client, metrics=Metrics(sink=lines.append))
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.4.0/24"})
+
+        # The VPC is rebuilt from the listing that spotted the change
+        document = json.loads(lines[0])
+
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(document["SubnetsScanned"], 4)
+        self.assertEqual(document["CacheHit"], 0)
+
+    def test_no_cache(self):
+        """
+        Without a cache every request starts from the live VPC
+        """
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        for _ in range(2):
+            handler(request, {}, responder=self.__responder, client=MockEc2(), cache=None)
+            self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+
+    def test_concurrent_discovery(self):
+        """
+        describe_vpcs and describe_subnets are in flight at the same time
+        """
+
+        class ConcurrentEc2(MockEc2):
+            barrier = threading.Barrier(2, timeout=5)
+
+            def describe_vpcs(self, **kwargs):
+                self.barrier.wait()
+                return super().describe_vpcs(**kwargs)
+
+            def describe_subnets(self, **kwargs):
+                self.barrier.wait()
+                return super().describe_subnets(**kwargs)
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=ConcurrentEc2())
+
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+
+    def test_describe_vpcs_error(self):
+        """
+        A failure describing the VPC is reported
+        """
+
+        class BrokenEc2(MockEc2):
+            def describe_vpcs(self, **kwargs):
+                raise Exception("VPC not found")
+
+        expected = {
+            "status": "FAILED",
+            "reason": "VPC not found",
+            "data": {},
+        }
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=BrokenEc2())
+
+        self.assertEqual(self.response, expected)
+
+    def test_metrics(self):
+        """
+        Each phase is timed and logged as a single metrics line
+        """
+
+        lines = []
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2(), metrics=Metrics(sink=lines.append))
+
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+        self.assertEqual(len(lines), 1)
+
+        document = json.loads(lines[0])
+
+        for name in ("Total", "Discovery", "DescribeVpcs", "DescribeSubnets", "Allocate", "SendResponse"):
+            self.assertIn(name, document)
+
+        self.assertEqual(document["SubnetsScanned"], 3)
+        self.assertEqual(document["CacheHit"], 0)
+        self.assertEqual(document["NetworksSearched"], 1)
+        self.assertEqual(document["VpcId"], "vpc-1")
+
+        lines = []
+
+        handler(request, {}, responder=self.__responder, client=MockEc2(), metrics=Metrics(sink=lines.append))
+
+        self.assertEqual(json.loads(lines[0])["CacheHit"], 1)
+
+    def test_metrics_disabled(self):
+        """
+        Nothing is logged unless metrics are turned on
+        """
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        with mock.patch.dict(os.environ, {"CIDR_FINDR_METRICS": ""}), mock.patch("builtins.print") as printed:
+            handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+        printed.assert_not_called()
+
+    def test_report_free_space(self):
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "",
+                "Sizes": ["17"],
+                "ReportFreeSpace": "true",
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.response["data"], {
+            "CidrBlock1": "10.0.128.0/17",
+            "FreeAddresses": "97664",
+            "LargestFreePrefix": "17",
+            "Fragmentation": "0.6645",
+        })
+
+    def test_report_free_space_empty_network(self):
+        """
+        An empty secondary CIDR reports its halves, the largest blocks that can be allocated
+        """
+
+        data = free_space(CidrFindr(networks=["10.0.0.0/24", "10.1.0.0/16"], subnets=["10.0.0.0/24"]))
+
+        self.assertEqual(data["LargestFreePrefix"], "17")
+
+    def test_reservations(self):
+        """
+        Concurrent stacks with no shared cache get distinct blocks
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            ledger = SqliteReservations(os.path.join(directory, "reservations.db"))
+
+            blocks = []
+            barrier = threading.Barrier(4)
+            lock = threading.Lock()
+
+            def create(i):
+                request = {
+                    "RequestType": "Create",
+                    "StackId": "stack-{}".format(i),
+                    "LogicalResourceId": "CidrFindr",
+                    "ResourceProperties": {
+                        "VpcId": "vpc-1",
+                        "Sizes": ["24"],
+                    },
+                }
+
+                def responder(event, context, status, reason=None, response_data={}, physical_resource_id=None):
+                    with lock:
+                        blocks.append(response_data.get("CidrBlock1", reason))
+
+                barrier.wait()
+                handler(request, {}, responder=responder, client=MockEc2(), cache=None, reservations=ledger)
+
+            threads = [threading.Thread(target=create, args=(i,)) for i in range(4)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            ledger.close()
+
+        self.assertEqual(sorted(blocks), ["10.0.2.0/24", "10.0.3.0/24", "10.0.4.0/24", "10.0.5.0/24"])
+
+    def test_reservation_conflict(self):
+        """
+        Losing a race to reserve starts over around the winner's blocks
+        """
+
+        class RacingLedger():
+            def __init__(self):
+                self.cidrs = []
+                self.version = 0
+
+            def reserved(self, vpc_id):
+                return self.version, list(self.cidrs)
+
+            def reserve(self, vpc_id, cidrs, owner, version):
+                if not self.cidrs:
+                    # Someone else gets there first
+                    self.cidrs.append("10.0.2.0/24")
+                    self.version += 1
+
+                if version != self.version:
+                    return False
+
+                self.cidrs.extend(cidrs)
+                self.version += 1
+
+                return True
+
+        ledger = RacingLedger()
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2(), reservations=ledger)
+
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.3.0/24"})
+        self.assertEqual(ledger.cidrs, ["10.0.2.0/24", "10.0.3.0/24"])
+
+    def test_reservations_unavailable(self):
+        """
+        A ledger that can't be opened fails the allocation but not a Delete
+        """
+
+        with mock.patch.dict(os.environ, {"CIDR_FINDR_RESERVATIONS": "/nonexistent/reservations.db"}):
+            handler({"RequestType": "Delete"}, {}, responder=self.__responder)
+
+            self.assertEqual(self.response["status"], "SUCCESS")
+
+            handler({
+                "RequestType": "Create",
+                "ResourceProperties": {
+                    "VpcId": "vpc-1",
+                    "Sizes": ["24"],
+                },
+            }, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.response["status"], "FAILED")
+        self.assertIn("Couldn't open the reservation ledger", self.response["reason"])
+
+    def test_reservations_error(self):
+        """
+        Errors from the ledger fail the request and leave nothing allocated
+        """
+
+        class BrokenLedger():
+            def __init__(self, fail_reserved):
+                self.fail_reserved = fail_reserved
+
+            def reserved(self, vpc_id):
+                if self.fail_reserved:
+                    raise OSError("disk I/O error")
+
+                return 0, []
+
+            def reserve(self, vpc_id, cidrs, owner, version):
+                raise OSError("database is locked")
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        for fail_reserved, reason in ((True, "Couldn't read the reservation ledger: disk I/O error"), (False, "Couldn't write to the reservation ledger: database is locked")):
+            handler(request, {}, responder=self.__responder, client=MockEc2(), reservations=BrokenLedger(fail_reserved))
+
+            self.assertEqual(self.response["status"], "FAILED")
+            self.assertEqual(self.response["reason"], reason)
+
+        # The failed attempt's block was given back
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+
+    def test_physical_resource_id(self):
+        """
+        The allocation is recorded in the physical id
+        """
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24", "25"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.physical_resource_id, "vpc-1|0a000200,0a000180|")
+
+    def test_physical_resource_id_ipv6(self):
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+                "Ipv6Sizes": ["64"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2Ipv6())
+
+        self.assertEqual(self.response["data"]["Ipv6CidrBlock1"], "2001:db8:1234:1a02::/64")
+        self.assertEqual(self.physical_resource_id, "vpc-1|0a000200|20010db812341a02")
+
+    def test_physical_resource_id_too_long(self):
+        """
+        An allocation too large to record fits CloudFormation's limit on physical ids
+        and is allocated afresh on Update
+        """
+
+        request = {
+            "RequestType": "Create",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["28"] * 120,
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(len(self.response["data"]), 120)
+        self.assertEqual(self.physical_resource_id, "vpc-1")
+
+        # 100 IPv4 blocks still fit
+        self.assertLessEqual(len(physical_resource_id("vpc-0123456789abcdef0", ["10.0.0.0/28"] * 100, [])), 1024)
+
+        update = dict(request, RequestType="Update", PhysicalResourceId="vpc-1", OldResourceProperties=request["ResourceProperties"])
+
+        handler(update, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.response["status"], "SUCCESS")
+        self.assertEqual(self.physical_resource_id, "vpc-1")
+
+    def test_update_bad_physical_id(self):
+        """
+        A physical id that doesn't decode is ignored rather than trusted
+        """
+
+        request = {
+            "RequestType": "Update",
+            "PhysicalResourceId": "vpc-1|0a000201|",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+            "OldResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        for resource_id in ("vpc-1|0a000201|", "vpc-1|nothex|", "vpc-1|1ffffffff|"):
+            handler(dict(request, PhysicalResourceId=resource_id), {}, responder=self.__responder, client=MockEc2(), cache=None)
+
+            self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24"})
+
+    def test_update_unchanged(self):
+        """
+        An Update that keeps the sizes keeps the blocks without looking at the VPC
+        """
+
+        class UnusedEc2():
+            def __getattr__(self, name):
+                raise AssertionError("EC2 was called")
+
+        request = {
+            "RequestType": "Update",
+            "PhysicalResourceId": "vpc-1|0a000200,0a000180|",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24", "25"],
+            },
+            "OldResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24", "25"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=UnusedEc2())
+
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.2.0/24", "CidrBlock2": "10.0.1.128/25"})
+        self.assertEqual(self.physical_resource_id, "vpc-1|0a000200,0a000180|")
+
+    def test_update_changed(self):
+        """
+        Only new and resized blocks are allocated, away from every old block
+        """
+
+        request = {
+            "RequestType": "Update",
+            "PhysicalResourceId": "vpc-1|0a000200,0a000300|",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24", "23", "24"],
+            },
+            "OldResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24", "24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.response["data"], {
+            "CidrBlock1": "10.0.2.0/24",
+            "CidrBlock2": "10.0.4.0/23",
+            "CidrBlock3": "10.0.6.0/24",
+        })
+        self.assertEqual(self.physical_resource_id, "vpc-1|0a000200,0a000400,0a000600|")
+
+    def test_update_new_vpc(self):
+        """
+        Moving to another VPC starts afresh
+        """
+
+        request = {
+            "RequestType": "Update",
+            "PhysicalResourceId": "vpc-1|0a000200|",
+            "ResourceProperties": {
+                "VpcId": "vpc-2",
+                "Sizes": ["24"],
+            },
+            "OldResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+
+        self.assertEqual(self.physical_resource_id, "vpc-2|0a000200|")
+
+    def test_retried_request(self):
+        """
+        A request CloudFormation sends again gets the same answer
+        """
+
+        request = {
+            "RequestType": "Create",
+            "RequestId": "request-1",
+            "LogicalResourceId": "CidrFindr",
+            "ResourceProperties": {
+                "VpcId": "vpc-1",
+                "Sizes": ["24"],
+            },
+        }
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+        first = (self.response, self.physical_resource_id)
+
+        handler(request, {}, responder=self.__responder, client=MockEc2())
+        self.assertEqual((self.response, self.physical_resource_id), first)
+
+        handler(dict(request, RequestId="request-2"), {}, responder=self.__responder, client=MockEc2())
+        self.assertEqual(self.response["data"], {"CidrBlock1": "10.0.3.0/24"})
+
+class MockEc2Multi():
+    """
+    Answers describe_vpcs and describe_subnets filtered on several VpcIds, counting the calls
+    """
+
+    def __init__(self):
+        self.calls = []
+
+        self.vpcs = {
+            "vpc-{}".format(i): {
+                "VpcId": "vpc-{}".format(i),
+                "CidrBlockAssociationSet": [{"CidrBlock": "10.{}.0.0/16".format(i)}],
+            }
+            for i in range(3)
+        }
+
+        self.subnets = [
+            {"VpcId": "vpc-{}".format(i), "CidrBlock": "10.{}.{}.0/24".format(i, j)}
+            for i in range(3)
+            for j in range(i + 1)
+        ]
+
+    def get_paginator(self, operation):
+        def pages(Filters):
+            vpc_ids = Filters[0]["Values"]
+            self.calls.append((operation, vpc_ids))
+
+            if operation == "describe_vpcs":
+                yield {"Vpcs": [self.vpcs[vpc_id] for vpc_id in vpc_ids if vpc_id in self.vpcs]}
+            else:
+                yield {"Subnets": [subnet for subnet in self.subnets if subnet["VpcId"] in vpc_ids]}
+
+        return MockPaginator(pages)
+
+class BatchHandlerTestCase(unittest.TestCase):
+    """
+    Test the multi-VPC batch handler
+    """
+
+    def setUp(self):
+        topology_cache.clear()
+
+    def test_batch(self):
+        client = MockEc2Multi()
+
+        event = {
+            "Requests": [
+                {"VpcId": "vpc-0", "Sizes": ["24"]},
+                {"VpcId": "vpc-2", "Sizes": ["24", "25"]},
+                {"VpcId": "vpc-0", "Sizes": ["24"]},
+                {"VpcId": "vpc-1", "Sizes": ["16"]},
+                {"VpcId": "vpc-9", "Sizes": ["24"]},
+                {"VpcId": "vpc-1", "Sizes": ["8"]},
+                {"Sizes": ["24"]},
+            ],
+        }
+
+        results = batch_handler(event, {}, client=client)["Results"]
+
+        self.assertEqual(results[:3], [
+            {"VpcId": "vpc-0", "CidrBlocks": ["10.0.1.0/24"], "Ipv6CidrBlocks": []},
+            {"VpcId": "vpc-2", "CidrBlocks": ["10.2.3.0/24", "10.2.4.0/25"], "Ipv6CidrBlocks": []},
+            {"VpcId": "vpc-0", "CidrBlocks": ["10.0.2.0/24"], "Ipv6CidrBlocks": []},
+        ])
+        self.assertRegex(results[3]["Error"], "Not enough space")
+        self.assertEqual(results[4], {"VpcId": "vpc-9", "Error": "VPC not found: vpc-9"})
+        self.assertEqual(results[5], {"VpcId": "vpc-1", "Error": "An invalid subnet size was specified: 8"})
+        self.assertEqual(results[6], {"VpcId": None, "Error": "Missing parameter(s): VpcId"})
+
+        # One call of each kind covers every VPC
+        self.assertEqual(sorted(client.calls), [
+            ("describe_subnets", ["vpc-0", "vpc-1", "vpc-2", "vpc-9"]),
+            ("describe_vpcs", ["vpc-0", "vpc-1", "vpc-2", "vpc-9"]),
+        ])
+
+    def test_cached(self):
+        """
+        Later batches see the blocks handed out
+        """
+
+        event = {"Requests": [{"VpcId": "vpc-0", "Sizes": ["24"]}]}
+
+        self.assertEqual(batch_handler(event, {}, client=MockEc2Multi())["Results"][0]["CidrBlocks"], ["10.0.1.0/24"])
+        self.assertEqual(batch_handler(event, {}, client=MockEc2Multi())["Results"][0]["CidrBlocks"], ["10.0.2.0/24"])
+
+    def test_chunked(self):
+        client = MockEc2Multi()
+        event = {"Requests": [{"VpcId": "vpc-{}".format(i), "Sizes": ["24"]} for i in range(3)]}
+
+        with mock.patch.object(discovery, "VPC_IDS_PER_FILTER", 2):
+            results = batch_handler(event, {}, client=client)["Results"]
+
+        self.assertEqual([result["CidrBlocks"] for result in results], [["10.0.1.0/24"], ["10.1.2.0/24"], ["10.2.3.0/24"]])
+        self.assertEqual(len(client.calls), 4)
+
+    def test_discovery_error(self):
+        class BrokenEc2(MockEc2Multi):
+            def get_paginator(self, operation):
+                raise Exception("Throttled")
+
+        event = {"Requests": [{"VpcId": "vpc-0", "Sizes": ["24"]}, {"VpcId": "vpc-1", "Sizes": ["x"]}]}
+
+        self.assertEqual(batch_handler(event, {}, client=BrokenEc2())["Results"], [
+            {"VpcId": "vpc-0", "Error": "Throttled"},
+            {"VpcId": "vpc-1", "Error": "An invalid subnet size was specified: x"},
+        ])
@@ -8,9 +8,56 @@ http://aws.amazon.com/apache2.0/
 or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
 """
 
-from cidr_findr.lambda_utils import parse_size, sizes_valid
+from cidr_findr.lambda_utils import ResponseSender, ipv6_sizes_valid, parse_size, send_response, sizes_valid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import json
+import threading
 import unittest
 
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Plays the part of the pre-signed S3 URL
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        server = self.server
+
+        server.requests.append((self.path, self.rfile.read(int(self.headers["Content-Length"]))))
+        server.clients.add(self.client_address)
+
+        status = server.statuses.pop(0) if server.statuses else 200
+
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, statuses=()):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+
+        self.statuses = list(statuses)
+        self.requests = []
+        self.clients = set()
+
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/bucket/key?X-Amz-Signature=abc".format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
 class LambdaUtilsTestCase(unittest.TestCase):
     """
     Test the lambda utils module
@@ -67,3 +114,171 @@ class LambdaUtilsTestCase(unittest.TestCase):
 
         for case, expected in cases:
             self.assertEqual(sizes_valid(case), expected)
+
+    def test_ipv6_sizes(self):
+        """
+        IPv6 subnet masks run from /44 to /64 in steps of 4
+        """
+
+        cases = (
+            ([], True),
+            ([64], True),
+            ([44, 56, 60], True),
+            ([40], False),
+            ([62], False),
+            ([68], False),
+            (["64"], False),
+        )
+
+        for case, expected in cases:
+            self.assertEqual(ipv6_sizes_valid(case), expected)
+
+class SendResponseTestCase(unittest.TestCase):
+    """
+    Test sending responses to a local stand-in for the pre-signed URL
+    """
+
+    def setUp(self):
+        self.sleeps = []
+        self.sender = ResponseSender(connect_timeout=1, read_timeout=1, attempts=3, backoff=0.5, sleep=self.sleeps.append)
+
+    def __event(self, server):
+        return {
+            "ResponseURL": server.url,
+            "StackId": "stack",
+            "RequestId": "request",
+            "LogicalResourceId": "CidrFindr",
+        }
+
+    def __serve(self, statuses=()):
+        server = StandInServer(statuses)
+        self.addCleanup(server.stop)
+        self.addCleanup(self.__close)
+        return server
+
+    def __close(self):
+        for connection in self.sender._connections.values():
+            connection.close()
+
+    def test_success(self):
+        """
+        The response body is PUT to the URL
+        """
+
+        server = self.__serve()
+
+        outcome = send_response(self.__event(server), SimpleNamespace(log_stream_name="stream"), "SUCCESS", response_data={"CidrBlock1": "10.0.0.0/24"}, sender=self.sender)
+
+        self.assertTrue(outcome)
+        self.assertEqual((outcome.status, outcome.attempts), (200, 1))
+        self.assertGreaterEqual(outcome.latency, 0)
+
+        path, body = server.requests[0]
+
+        self.assertEqual(path, "/bucket/key?X-Amz-Signature=abc")
+        self.assertEqual(json.loads(body.decode("utf-8")), {
+            "Status": "SUCCESS",
+            "PhysicalResourceId": "stream",
+            "StackId": "stack",
+            "RequestId": "request",
+            "LogicalResourceId": "CidrFindr",
+            "Data": {"CidrBlock1": "10.0.0.0/24"},
+        })
+
+    def test_physical_resource_id(self):
+        """
+        A resource keeps its physical id unless a new one is given
+        """
+
+        server = self.__serve()
+        event = dict(self.__event(server), PhysicalResourceId="existing")
+        context = SimpleNamespace(log_stream_name="stream")
+
+        send_response(event, context, "SUCCESS", sender=self.sender)
+        send_response(event, context, "SUCCESS", sender=self.sender, physical_resource_id="vpc-1|10.0.0.0/24|")
+
+        self.assertEqual([json.loads(body.decode("utf-8"))["PhysicalResourceId"] for _, body in server.requests], ["existing", "vpc-1|10.0.0.0/24|"])
+
+    def test_retry_server_error(self):
+        """
+        Server errors are retried with exponential backoff
+        """
+
+        server = self.__serve([500, 503])
+
+        outcome = self.sender.put(server.url, b"{}")
+
+        self.assertTrue(outcome)
+        self.assertEqual(outcome.attempts, 3)
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+
+    def test_give_up(self):
+        """
+        Retries are bounded
+        """
+
+        server = self.__serve([500, 500, 500, 500])
+
+        outcome = self.sender.put(server.url, b"{}")
+
+        self.assertFalse(outcome)
+        self.assertEqual((outcome.status, outcome.error, outcome.attempts), (500, "HTTP 500", 3))
+
+    def test_no_retry_client_error(self):
+        """
+        Client errors such as an expired URL aren't retried
+        """
+
+        server = self.__serve([403])
+
+        outcome = self.sender.put(server.url, b"{}")
+
+        self.assertFalse(outcome)
+        self.assertEqual((outcome.status, outcome.attempts), (403, 1))
+        self.assertEqual(self.sleeps, [])
+
+    def test_keep_alive(self):
+        """
+        Later responses reuse the open connection
+        """
+
+        server = self.__serve()
+
+        self.assertTrue(self.sender.put(server.url, b"{}"))
+        self.assertTrue(self.sender.put(server.url, b"{}"))
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(len(server.clients), 1)
+
+    def test_stale_connection(self):
+        """
+        A kept-alive connection closed by the server is replaced without using up an attempt
+        """
+
+        server = self.__serve()
+
+        self.assertTrue(self.sender.put(server.url, b"{}"))
+
+        for connection in self.sender._connections.values():
+            connection.sock.close()
+
+        outcome = self.sender.put(server.url, b"{}")
+
+        self.assertTrue(outcome)
+        self.assertEqual(outcome.attempts, 1)
+
+    def test_unreachable(self):
+        """
+        Connection failures are reported with the error
+        """
+
+        server = self.__serve()
+        url = server.url
+        server.stop()
+
+        outcome = self.sender.put(url, b"{}")
+
+        self.assertFalse(outcome)
+        self.assertIsNone(outcome.status)
+        self.assertEqual(outcome.attempts, 3)
+        self.assertTrue(outcome.error)
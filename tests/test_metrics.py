@@ -0,0 +1,107 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr.metrics import NULL_METRICS, Metrics, new_metrics
+from unittest import mock
+import json
+import os
+import unittest
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    Test metrics collection and the embedded metric format
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.lines = []
+        self.metrics = Metrics(sink=self.lines.append, clock=self.clock)
+
+    def test_span(self):
+        with self.metrics.span("Allocate"):
+            self.clock.now += 0.25
+
+        with self.metrics.span("Allocate"):
+            self.clock.now += 0.5
+
+        self.assertEqual(self.metrics.timings, {"Allocate": 750.0})
+
+    def test_span_error(self):
+        """
+        Time is recorded even when the block raises
+        """
+
+        with self.assertRaises(ValueError):
+            with self.metrics.span("Discovery"):
+                self.clock.now += 1
+                raise ValueError()
+
+        self.assertEqual(self.metrics.timings, {"Discovery": 1000.0})
+
+    def test_timed(self):
+        def pages():
+            for page in range(3):
+                self.clock.now += 0.1
+                yield page
+
+        self.assertEqual(list(self.metrics.timed("DescribeSubnets", pages())), [0, 1, 2])
+        self.assertAlmostEqual(self.metrics.timings["DescribeSubnets"], 300.0)
+
+    def test_emit(self):
+        with self.metrics.span("Total"):
+            self.clock.now += 0.002
+
+        self.metrics.count("CacheHit")
+        self.metrics.count("SubnetsScanned", 5)
+        self.metrics.set_property("VpcId", "vpc-1")
+        self.metrics.emit()
+
+        self.assertEqual(len(self.lines), 1)
+
+        document = json.loads(self.lines[0])
+
+        self.assertEqual(document["Total"], 2.0)
+        self.assertEqual(document["CacheHit"], 1)
+        self.assertEqual(document["SubnetsScanned"], 5)
+        self.assertEqual(document["VpcId"], "vpc-1")
+
+        directive = document["_aws"]["CloudWatchMetrics"][0]
+
+        self.assertEqual(directive["Namespace"], "CidrFindr")
+        self.assertEqual(directive["Dimensions"], [[]])
+        self.assertEqual(directive["Metrics"], [
+            {"Name": "Total", "Unit": "Milliseconds"},
+            {"Name": "CacheHit", "Unit": "Count"},
+            {"Name": "SubnetsScanned", "Unit": "Count"},
+        ])
+        self.assertIsInstance(document["_aws"]["Timestamp"], int)
+
+    def test_null_metrics(self):
+        pages = [1, 2]
+
+        with NULL_METRICS.span("Total"):
+            pass
+
+        self.assertIs(NULL_METRICS.timed("DescribeSubnets", pages), pages)
+        self.assertFalse(NULL_METRICS.enabled)
+
+    def test_new_metrics(self):
+        with mock.patch.dict(os.environ, {"CIDR_FINDR_METRICS": "1"}):
+            self.assertIsInstance(new_metrics(), Metrics)
+
+        with mock.patch.dict(os.environ, {"CIDR_FINDR_METRICS": ""}):
+            self.assertIs(new_metrics(), NULL_METRICS)
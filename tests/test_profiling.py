@@ -0,0 +1,170 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr import CidrFindr
+from cidr_findr.profiling import profiled
+from unittest import mock
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class ProfilingTestCase(unittest.TestCase):
+    """
+    Test on-demand profiling
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lines = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def allocate(self):
+        findr = CidrFindr(networks=["10.0.0.0/16"], subnets=["10.0.0.0/24"])
+
+        return [findr.next_subnet(24) for _ in range(4)]
+
+    def test_disabled(self):
+        """
+        When profiling is off the function is returned as it is
+        """
+
+        with mock.patch.dict(os.environ, {"CIDR_FINDR_PROFILE": ""}):
+            decorate = profiled("allocate")
+
+        self.assertIs(decorate(CidrFindr.next_subnet), CidrFindr.next_subnet)
+
+    def test_profile(self):
+        """
+        A profiled call writes its stats and allocations and logs a summary
+        """
+
+        allocate = profiled("allocate", enabled=True, directory=self.directory, top=3, log=self.lines.append)(self.allocate)
+
+        self.assertEqual(allocate(), ["10.0.1.0/24", "10.0.2.0/24", "10.0.3.0/24", "10.0.4.0/24"])
+
+        files = sorted(os.listdir(self.directory))
+
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].startswith("cidr-findr-allocate-"))
+        self.assertTrue(files[0].endswith(".mem.txt"))
+        self.assertTrue(files[1].endswith(".prof"))
+
+        summary = self.lines[0].splitlines()
+
+        self.assertEqual(len(self.lines), 1)
+        self.assertIn("Profile of allocate written to", summary[0])
+        self.assertIn("Allocations written to", summary[4])
+        self.assertLessEqual(len(summary), 8)
+
+        import pstats
+
+        stats = pstats.Stats(os.path.join(self.directory, files[1]))
+
+        self.assertTrue(any(function == "next_subnet" for _, _, function in stats.stats))
+
+    def test_exception(self):
+        """
+        A call that raises is still profiled and the exception passes through
+        """
+
+        def fail():
+            raise ValueError("nope")
+
+        fail = profiled("fail", enabled=True, directory=self.directory, log=self.lines.append)(fail)
+
+        with self.assertRaises(ValueError):
+            fail()
+
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(len(self.lines), 1)
+
+    def test_report_fails(self):
+        """
+        A profile that can't be written is logged and the call still returns its result
+        """
+
+        missing = os.path.join(self.directory, "missing")
+        allocate = profiled("allocate", enabled=True, directory=missing, log=self.lines.append)(self.allocate)
+
+        self.assertEqual(len(allocate()), 4)
+        self.assertEqual(len(self.lines), 1)
+        self.assertIn("Couldn't write the profile of allocate", self.lines[0])
+
+    def test_nested(self):
+        """
+        Profiled calls inside a profiled call don't start a profile of their own
+        """
+
+        inner = profiled("inner", enabled=True, directory=self.directory, log=self.lines.append)(self.allocate)
+        outer = profiled("outer", enabled=True, directory=self.directory, log=self.lines.append)(inner)
+
+        outer()
+
+        self.assertEqual(len(self.lines), 1)
+        self.assertIn("Profile of outer", self.lines[0])
+
+    def test_sample(self):
+        """
+        Only a sample of the calls are profiled
+        """
+
+        allocate = profiled("allocate", enabled=True, sample=4, directory=self.directory, log=self.lines.append)(self.allocate)
+
+        with mock.patch("random.random", side_effect=[0.1, 0.3, 0.6, 0.9, 0.2]):
+            for _ in range(5):
+                allocate()
+
+        self.assertEqual(len(self.lines), 2)
+
+    def test_environment(self):
+        """
+        The settings come from the environment
+        """
+
+        with mock.patch.dict(os.environ, {
+            "CIDR_FINDR_PROFILE": "1",
+            "CIDR_FINDR_PROFILE_DIR": self.directory,
+            "CIDR_FINDR_PROFILE_TOP": "2",
+        }):
+            allocate = profiled("allocate", log=self.lines.append)(self.allocate)
+
+        allocate()
+
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(len(self.lines[0].splitlines()), 6)
+
+    def test_no_imports_when_disabled(self):
+        """
+        With profiling off, using the package doesn't import the profilers
+        """
+
+        env = dict(os.environ)
+        env.pop("CIDR_FINDR_PROFILE", None)
+
+        output = subprocess.run(
+            [sys.executable, "-c", "import cidr_findr, sys; cidr_findr.CidrFindr(networks=['10.0.0.0/16']).next_subnet(24); print(sorted(set(sys.modules) & {'cProfile', 'pstats', 'tracemalloc', 'random'}))"],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+
+        self.assertEqual(output.stdout.strip(), "[]")
+
+if __name__ == "__main__":
+    unittest.main()
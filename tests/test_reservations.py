@@ -0,0 +1,92 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr.reservations import SqliteReservations
+import os
+import tempfile
+import unittest
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class SqliteReservationsTestCase(unittest.TestCase):
+    """
+    Test the SQLite reservation ledger
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "reservations.db")
+        self.clock = FakeClock()
+        self.ledger = SqliteReservations(self.path, ttl=60, clock=self.clock)
+
+    def tearDown(self):
+        self.ledger.close()
+        self.directory.cleanup()
+
+    def test_empty(self):
+        self.assertEqual(self.ledger.reserved("vpc-1"), (0, []))
+
+    def test_reserve(self):
+        version, _ = self.ledger.reserved("vpc-1")
+
+        self.assertTrue(self.ledger.reserve("vpc-1", ["10.0.0.0/24", "10.0.1.0/24"], "stack-1", version))
+
+        version, reserved = self.ledger.reserved("vpc-1")
+
+        self.assertEqual(version, 1)
+        self.assertEqual(sorted(reserved), ["10.0.0.0/24", "10.0.1.0/24"])
+        self.assertEqual(self.ledger.reserved("vpc-2"), (0, []))
+
+    def test_stale_version(self):
+        """
+        A write based on an out of date read is refused
+        """
+
+        version, _ = self.ledger.reserved("vpc-1")
+
+        self.assertTrue(self.ledger.reserve("vpc-1", ["10.0.0.0/24"], "stack-1", version))
+        self.assertFalse(self.ledger.reserve("vpc-1", ["10.0.0.0/24"], "stack-2", version))
+
+        self.assertEqual(self.ledger.reserved("vpc-1"), (1, ["10.0.0.0/24"]))
+
+    def test_expiry(self):
+        self.ledger.reserve("vpc-1", ["10.0.0.0/24"], "stack-1", 0)
+
+        self.clock.now += 60
+
+        self.assertEqual(self.ledger.reserved("vpc-1"), (1, []))
+
+        self.assertTrue(self.ledger.reserve("vpc-1", ["10.0.0.0/24"], "stack-2", 1))
+        self.assertEqual(self.ledger.reserved("vpc-1"), (2, ["10.0.0.0/24"]))
+
+    def test_release(self):
+        self.ledger.reserve("vpc-1", ["10.0.0.0/24", "10.0.1.0/24"], "stack-1", 0)
+        self.ledger.release("vpc-1", ["10.0.0.0/24"])
+
+        self.assertEqual(self.ledger.reserved("vpc-1"), (2, ["10.0.1.0/24"]))
+
+    def test_shared_file(self):
+        """
+        Separate connections to one file see each other's reservations
+        """
+
+        other = SqliteReservations(self.path, ttl=60, clock=self.clock)
+
+        try:
+            self.assertTrue(other.reserve("vpc-1", ["10.0.0.0/24"], "stack-1", 0))
+            self.assertFalse(self.ledger.reserve("vpc-1", ["10.0.0.0/24"], "stack-2", 0))
+            self.assertEqual(self.ledger.reserved("vpc-1"), (1, ["10.0.0.0/24"]))
+        finally:
+            other.close()
@@ -0,0 +1,138 @@
+"""
+Copyright 2016-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
+
+http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the specific language governing permissions and limitations under the License.
+"""
+
+from cidr_findr import ArrayNetwork, BuddyNetwork, CidrFindr, CidrFindrException, Network
+from cidr_findr import snapshot
+from unittest import mock
+import os
+import tempfile
+import unittest
+
+class SnapshotTestCase(unittest.TestCase):
+    """
+    Test saving and restoring CidrFindr state
+    """
+
+    def setUp(self):
+        self.findr = CidrFindr(
+            networks=["10.0.0.0/16", "10.1.0.0/24", "2001:db8::/56"],
+            subnets=["10.0.0.0/24", "10.0.2.0/23", "10.1.0.128/25", "2001:db8::/64"],
+        )
+
+    def assertSameAllocations(self, first, second):
+        for reqs, version in (([24, 26, 28, 20], 4), ([64, 60], 6)):
+            self.assertEqual(first.next_subnets(reqs, version), second.next_subnets(reqs, version))
+
+    def test_round_trip(self):
+        loaded = CidrFindr.from_snapshot(self.findr.snapshot())
+
+        self.assertEqual([network.network for network in loaded.networks], [network.network for network in self.findr.networks])
+        self.assertEqual([sorted(map(str, network.subnets)) for network in loaded.networks], [sorted(map(str, network.subnets)) for network in self.findr.networks])
+
+        self.assertSameAllocations(self.findr, loaded)
+
+    def test_includes_allocations(self):
+        allocated = self.findr.next_subnet(24)
+
+        loaded = CidrFindr.from_snapshot(self.findr.snapshot())
+
+        self.assertIn(allocated, [str(subnet) for subnet in loaded.networks[0].subnets])
+        self.assertSameAllocations(self.findr, loaded)
+
+    def test_network_class(self):
+        findr = CidrFindr(network="10.0.0.0/16", subnets=["10.0.0.0/24"], network_class=BuddyNetwork)
+
+        loaded = CidrFindr.from_snapshot(findr.snapshot())
+
+        self.assertIs(loaded.network_class, BuddyNetwork)
+        self.assertIsInstance(loaded.networks[0], BuddyNetwork)
+        self.assertIsNone(CidrFindr.from_snapshot(self.findr.snapshot()).network_class)
+
+    def test_array_network(self):
+        """
+        ArrayNetwork columns are loaded as they are, without adding subnets one at a time
+        """
+
+        subnets = ["10.0.{}.{}/28".format(i // 16, i % 16 * 16) for i in range(0, 999, 3)] + ["10.0.0.0/24"]
+        findr = CidrFindr(network="10.0.0.0/16", subnets=subnets, network_class=ArrayNetwork)
+
+        with mock.patch.object(ArrayNetwork, "add_subnet", side_effect=AssertionError("added")):
+            loaded = CidrFindr.from_snapshot(findr.snapshot())
+
+        self.assertIsInstance(loaded.networks[0], ArrayNetwork)
+        self.assertEqual(list(loaded.networks[0].subnets), list(findr.networks[0].subnets))
+        self.assertEqual(list(loaded.networks[0].free_gaps()), list(findr.networks[0].free_gaps()))
+        self.assertEqual(loaded.next_subnets([24, 28, 26]), findr.next_subnets([24, 28, 26]))
+
+    def test_aligned(self):
+        """
+        Every network record is padded to 8 bytes, whatever its subnet count
+        """
+
+        for count in range(1, 9):
+            findr = CidrFindr(networks=["10.0.0.0/16", "10.1.0.0/16"], subnets=["10.0.{}.0/24".format(i) for i in range(count)])
+            data = findr.snapshot()
+
+            second = snapshot.HEADER.size + snapshot.NETWORK.size + 5 * count + -5 * count % 8
+
+            self.assertEqual(second % 8, 0)
+            self.assertEqual(snapshot.NETWORK.unpack_from(data, second)[:2], (32, 16))
+            self.assertEqual(len(data) % 8, 0)
+
+    def test_unknown_network_class(self):
+        class CustomNetwork(Network):
+            pass
+
+        findr = CidrFindr(network="10.0.0.0/16", network_class=CustomNetwork)
+
+        with self.assertRaisesRegex(CidrFindrException, "Can't snapshot a CustomNetwork network"):
+            findr.snapshot()
+
+    def test_no_parsing(self):
+        data = self.findr.snapshot()
+
+        with mock.patch("cidr_findr.cidr_findr.parse_cidr", side_effect=AssertionError("parsed")):
+            CidrFindr.from_snapshot(data)
+
+    def test_invalid(self):
+        data = self.findr.snapshot()
+
+        with self.assertRaisesRegex(CidrFindrException, "Not a CIDR finder snapshot"):
+            CidrFindr.from_snapshot(b"nonsense" * 4)
+
+        with self.assertRaisesRegex(CidrFindrException, "Unsupported snapshot version 99"):
+            CidrFindr.from_snapshot(data[:4] + b"\x63\x00" + data[6:])
+
+        with self.assertRaisesRegex(CidrFindrException, "Truncated snapshot"):
+            CidrFindr.from_snapshot(data[:-20])
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "vpc.snapshot")
+
+            snapshot.dump(self.findr, path)
+
+            self.assertSameAllocations(snapshot.load(path), CidrFindr.from_snapshot(self.findr.snapshot()))
+            self.assertEqual(os.listdir(directory), ["vpc.snapshot"])
+
+    def test_memory_mapped(self):
+        subnets = ["10.{}.{}.0/24".format(i // 256, i % 256) for i in range(0, 4096, 2)]
+        findr = CidrFindr(network="10.0.0.0/8", subnets=subnets)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "vpc.snapshot")
+
+            snapshot.dump(findr, path)
+
+            with mock.patch.object(snapshot, "MMAP_THRESHOLD", 1024):
+                loaded = snapshot.load(path)
+
+        self.assertEqual(len(loaded.networks[0].subnets), len(subnets))
+        self.assertEqual(loaded.next_subnets([24, 24]), findr.next_subnets([24, 24]))